@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Буферизованная пакетная запись
+
+Записи копятся в памяти и сбрасываются одной пачкой, когда набирается
+max_batch записей или проходит max_delay секунд с первой записи в буфере.
+Вызывающий код не ждет записи в БД.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+    Фоновый писатель пачек
+
+    add() только кладет запись в буфер. Сброс выполняет фоновая задача;
+    при ошибке пачка возвращается в буфер и повторяется при следующем
+    сбросе. Если буфер переполнен (БД долго недоступна), самые старые
+    записи отбрасываются.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Any]], Awaitable[None]],
+        max_batch: int,
+        max_delay: float,
+        max_pending: int = 10000,
+        name: str = "batch_writer"
+    ):
+        self._flush = flush
+        self._max_batch = max(1, max_batch)
+        self._max_delay = max_delay
+        self._max_pending = max(self._max_batch, max_pending)
+        self._name = name
+        self._buffer: List[Any] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def pending_count(self) -> int:
+        """Количество записей, ожидающих сброса"""
+        return len(self._buffer)
+
+    def start(self):
+        """Запустить фоновый сброс"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def add(self, record: Any):
+        """Добавить запись в буфер (не ждет записи)"""
+        self._buffer.append(record)
+        if len(self._buffer) > self._max_pending:
+            dropped = len(self._buffer) - self._max_pending
+            del self._buffer[:dropped]
+            logger.error(f"❌ [{self._name}] Буфер переполнен, отброшено записей: {dropped}")
+        # Будим сброс на первой записи (старт отсчета max_delay) и на полной пачке
+        if len(self._buffer) == 1 or len(self._buffer) >= self._max_batch:
+            self._wakeup.set()
+
+    async def close(self):
+        """Остановить фоновый сброс и записать остаток буфера"""
+        self._closing = True
+        self._wakeup.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._buffer and await self._flush_batch():
+            pass
+        if self._buffer:
+            logger.error(f"❌ [{self._name}] При остановке не записано записей: {len(self._buffer)}")
+
+    async def _run(self):
+        """Сбрасывать буфер по размеру или по времени"""
+        while not self._closing:
+            if not self._buffer:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+
+            if len(self._buffer) < self._max_batch and not self._closing:
+                # Первая запись уже ждет - даем пачке набраться не дольше max_delay
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            if self._closing:
+                return
+            if self._buffer and not await self._flush_batch():
+                # БД недоступна: повторим не раньше, чем через max_delay
+                await asyncio.sleep(self._max_delay)
+
+    async def _flush_batch(self) -> bool:
+        """Записать одну пачку; при ошибке вернуть ее в начало буфера"""
+        batch = self._buffer[:self._max_batch]
+        del self._buffer[:len(batch)]
+        try:
+            await self._flush(batch)
+            return True
+        except Exception as e:
+            logger.error(f"❌ [{self._name}] Ошибка записи пачки из {len(batch)}: {e}")
+            self._buffer[:0] = batch
+            return False
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Простые in-memory кэши для горячих данных бота
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру LRU кэш с необязательным временем жизни записей
+
+    При превышении maxsize вытесняется запись, к которой дольше всего
+    не обращались. Если задан ttl (секунды), записи старше ttl считаются
+    отсутствующими.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not None
+
+    def _lookup(self, key: Hashable) -> Optional[tuple]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Получить значение и отметить запись как недавно использованную"""
+        entry = self._lookup(key)
+        if entry is None:
+            return default
+        self._data.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Сохранить значение, вытеснив самую старую запись при переполнении"""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Удалить запись"""
+        entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        """Очистить кэш"""
+        self._data.clear()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Параллельный диспетчер с сохранением порядка внутри ключа
+
+Элементы с разными ключами обрабатываются конкурентно (не более max_workers
+одновременно), элементы с одинаковым ключом - строго по очереди в порядке
+поступления.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Iterable, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedDispatcher:
+    """
+    Диспетчер задач с ограничением параллелизма и порядком по ключу
+
+    Для каждого ключа заводится собственная очередь и корутина-обработчик,
+    которая живет, пока в очереди есть элементы. Общий семафор ограничивает
+    число одновременно выполняемых обработчиков.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        max_workers: int,
+        name: str = "dispatcher"
+    ):
+        self._handler = handler
+        self._semaphore = asyncio.Semaphore(max(1, max_workers))
+        self._name = name
+        self._pending: Dict[Hashable, Deque[Tuple[Any, asyncio.Future]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def pending_count(self) -> int:
+        """Количество элементов, ожидающих обработки"""
+        return sum(len(queue) for queue in self._pending.values())
+
+    def submit(self, key: Hashable, item: Any) -> asyncio.Future:
+        """
+        Поставить элемент в очередь ключа
+
+        Returns:
+            Future, который завершится результатом обработчика
+        """
+        done = asyncio.get_running_loop().create_future()
+        queue = self._pending.get(key)
+
+        if queue is None:
+            queue = self._pending[key] = deque()
+            task = asyncio.create_task(self._drain(key, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        queue.append((item, done))
+        return done
+
+    async def dispatch(self, items: Iterable[Tuple[Hashable, Any]]) -> list:
+        """Обработать пачку пар (ключ, элемент) и дождаться завершения всех"""
+        futures = [self.submit(key, item) for key, item in items]
+        if not futures:
+            return []
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    async def join(self):
+        """Дождаться обработки всех поставленных элементов"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def close(self):
+        """Отменить обработку оставшихся элементов"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _drain(self, key: Hashable, queue: Deque[Tuple[Any, asyncio.Future]]):
+        """Последовательно обработать очередь одного ключа"""
+        try:
+            while queue:
+                item, done = queue.popleft()
+                try:
+                    async with self._semaphore:
+                        result = await self._handler(item)
+                    if not done.done():
+                        done.set_result(result)
+                except asyncio.CancelledError:
+                    if not done.done():
+                        done.cancel()
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ [{self._name}] Ошибка обработки элемента ключа {key}: {e}")
+                    if not done.done():
+                        done.set_exception(e)
+        finally:
+            # Отменяем то, что не успели обработать (например, при остановке)
+            for _, done in queue:
+                if not done.done():
+                    done.cancel()
+            self._pending.pop(key, None)
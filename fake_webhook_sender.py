@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Локальный отправитель тестовых обновлений в webhook бота
+
+Имитирует доставку MAX: формирует обновления message_created и отправляет
+их на webhook endpoint FastAPI приложения.
+
+Примеры:
+    python fake_webhook_sender.py --text "/задачи"
+    python fake_webhook_sender.py --user-id 1 --user-id 2 --text "/создать Тест" --text "/задачи"
+    python fake_webhook_sender.py --count 100 --concurrency 20 --text "/помощь"
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from typing import List, Optional
+
+import httpx
+
+
+def build_message_update(user_id: int, text: str, chat_id: Optional[int] = None) -> dict:
+    """Сформировать обновление message_created в формате MAX API"""
+    timestamp = int(time.time() * 1000)
+    return {
+        "update_type": "message_created",
+        "timestamp": timestamp,
+        "message": {
+            "sender": {
+                "user_id": user_id,
+                "first_name": f"Test{user_id}",
+                "last_name": "",
+            },
+            "recipient": {
+                "chat_id": chat_id or user_id,
+                "chat_type": "dialog",
+            },
+            "timestamp": timestamp,
+            "body": {
+                "mid": f"fake.{uuid.uuid4().hex}",
+                "seq": timestamp,
+                "text": text,
+            },
+        },
+    }
+
+
+async def send_updates(
+    url: str,
+    user_ids: List[int],
+    texts: List[str],
+    count: int,
+    concurrency: int,
+    secret: str = ""
+):
+    """Отправить обновления: для каждого пользователя count раз все тексты по порядку"""
+    headers = {"X-Max-Bot-Api-Secret": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async with httpx.AsyncClient(timeout=30.0, headers=headers) as client:
+
+        async def send_user_sequence(user_id: int):
+            nonlocal failures
+            # Сообщения одного пользователя уходят последовательно, как в реальном чате
+            for _ in range(count):
+                for text in texts:
+                    update = build_message_update(user_id, text)
+                    async with semaphore:
+                        started = time.perf_counter()
+                        response = await client.post(url, json=update)
+                        latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        failures += 1
+                        print(f"❌ {user_id}: {response.status_code} - {response.text}")
+
+        await asyncio.gather(*(send_user_sequence(user_id) for user_id in user_ids))
+
+    if latencies:
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(f"📬 Отправлено: {len(latencies)}, ошибок: {failures}, p50: {p50:.1f} мс, p99: {p99:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка тестовых обновлений в webhook бота")
+    parser.add_argument("--url", default="http://localhost:8000/webhook", help="Адрес webhook")
+    parser.add_argument("--user-id", type=int, action="append", dest="user_ids", help="ID пользователя (можно несколько)")
+    parser.add_argument("--text", action="append", dest="texts", help="Текст сообщения (можно несколько)")
+    parser.add_argument("--count", type=int, default=1, help="Сколько раз повторить последовательность")
+    parser.add_argument("--concurrency", type=int, default=10, help="Максимум одновременных запросов")
+    parser.add_argument("--secret", default="", help="Секрет webhook (WEBHOOK_SECRET)")
+    args = parser.parse_args()
+
+    asyncio.run(send_updates(
+        url=args.url,
+        user_ids=args.user_ids or [1],
+        texts=args.texts or ["/помощь"],
+        count=args.count,
+        concurrency=args.concurrency,
+        secret=args.secret,
+    ))
+
+
+if __name__ == "__main__":
+    main()
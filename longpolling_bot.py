@@ -2,16 +2,23 @@
 """
 MAX Bot с Long Polling для управления задачами
 Команды:
-- /задачи - вывести список задач пользователя
-- /готово {id} - отметить задачу выполненной
+- /задачи [дальше|назад] - вывести страницу списка задач пользователя
+- /готово {id ...} - отметить задачи выполненными (можно несколько и диапазоны)
 - /создать {описание} - создать новую задачу
+- /настроение - статистика самочувствия за неделю и месяц
+- /найти {запрос} - поиск задач чата по названию, описанию и тегу
+- /пояс {зона} - часовой пояс для времени ритуалов
 """
 
 import asyncio
+import hashlib
+import json
 import logging
+import mimetypes
 import re
-from typing import Optional, Dict, Any, List
-from datetime import datetime, time as time_class
+import socket
+from typing import Optional, Dict, Any, List, Set
+from datetime import datetime, timedelta, timezone, time as time_class
 import httpx
 import asyncpg
 import os
@@ -19,6 +26,14 @@ from pathlib import Path
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 import ritual_config
+import ritual_schedule
+from cache import LRUCache
+from batch_writer import BatchWriter
+from dispatcher import KeyedDispatcher
+from outbound_queue import OutboundQueue, is_retryable
+import migrate
+import repository
+from repository import Page, Repository, SearchPage
 
 # Настройка логирования
 logging.basicConfig(
@@ -40,28 +55,229 @@ DATABASE_URL = os.getenv(
 
 BASE_URL = "https://botapi.max.ru"
 
+# Применять миграции схемы БД при запуске
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "1") == "1"
+
+# Максимальное число обновлений, обрабатываемых одновременно
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+
+# Сколько полученных пачек обновлений может ждать обработки,
+# прежде чем поллер приостановится (backpressure)
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "4"))
+
+# Таймаут long polling запроса и пауза после ошибки API (секунды)
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "60"))
+POLL_ERROR_DELAY = float(os.getenv("POLL_ERROR_DELAY", "5"))
+
+# Сколько последних ID обновлений помнить в памяти для быстрой дедупликации
+UPDATE_LEDGER_WINDOW = int(os.getenv("UPDATE_LEDGER_WINDOW", "10000"))
+
+# Сколько часов хранить ID обработанных обновлений в БД
+UPDATE_LEDGER_RETENTION_HOURS = int(os.getenv("UPDATE_LEDGER_RETENTION_HOURS", "72"))
+
+# На сколько секунд обновление закрепляется за обработчиком: если процесс
+# упал посреди обработки, после этого срока обновление можно обработать снова
+UPDATE_CLAIM_SECONDS = int(os.getenv("UPDATE_CLAIM_SECONDS", "120"))
+
+# Ключ, под которым в bot_state хранится marker long polling
+MARKER_STATE_KEY = "updates_marker"
+
+# Сколько обновлений, принятых через webhook, может ждать обработки
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Очередь исходящих сообщений: число параллельных отправок,
+# общий лимит MAX API и лимит на одного получателя (запросов в секунду)
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+MAX_API_RPS = float(os.getenv("MAX_API_RPS", "25"))
+MAX_API_BURST = float(os.getenv("MAX_API_BURST", "30"))
+RECIPIENT_RPS = float(os.getenv("RECIPIENT_RPS", "1"))
+RECIPIENT_BURST = float(os.getenv("RECIPIENT_BURST", "3"))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "10000"))
+OUTBOUND_SHUTDOWN_TIMEOUT = float(os.getenv("OUTBOUND_SHUTDOWN_TIMEOUT", "10"))
+
+# Outbox: размер пачки, интервал опроса (секунды), число попыток доставки,
+# аренда строки на время отправки и срок хранения отправленных (часы)
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", "48"))
+
+# Запись самочувствия пачками: размер пачки, максимальная задержка (секунды)
+# и предел буфера, если БД недоступна
+MOOD_BATCH_SIZE = int(os.getenv("MOOD_BATCH_SIZE", "200"))
+MOOD_FLUSH_INTERVAL = float(os.getenv("MOOD_FLUSH_INTERVAL", "1"))
+MOOD_BUFFER_LIMIT = int(os.getenv("MOOD_BUFFER_LIMIT", "10000"))
+
+# Хранение: на сколько месяцев вперед создавать секции mood_logs, сколько
+# полных месяцев хранить сырые записи (старше - только дневные агрегаты)
+MOOD_PARTITIONS_AHEAD = int(os.getenv("MOOD_PARTITIONS_AHEAD", "2"))
+MOOD_RAW_RETENTION_MONTHS = int(os.getenv("MOOD_RAW_RETENTION_MONTHS", "6"))
+
+# Ритуалы: сколько пользователей обрабатывать за одну выборку и с каким
+# опозданием (минуты) ритуал еще отправлять, например после простоя бота
+RITUAL_BATCH_SIZE = int(os.getenv("RITUAL_BATCH_SIZE", "500"))
+RITUAL_MAX_DELAY_MINUTES = int(os.getenv("RITUAL_MAX_DELAY_MINUTES", "30"))
+
+# На сколько минут вперед держать ритуалы в памяти и пауза после ошибки (секунды)
+RITUAL_QUEUE_HORIZON_MINUTES = int(os.getenv("RITUAL_QUEUE_HORIZON_MINUTES", "15"))
+RITUAL_RETRY_INTERVAL = float(os.getenv("RITUAL_RETRY_INTERVAL", "30"))
+
+# Изменения из процесса без планировщика (вебхук без CLUSTER_MODE) видны только
+# после перезагрузки очереди: горизонт меньше допустимого опоздания, иначе такой
+# ритуал будет найден уже просроченным и пропущен
+RITUAL_QUEUE_HORIZON_MINUTES = min(RITUAL_QUEUE_HORIZON_MINUTES, max(1, RITUAL_MAX_DELAY_MINUTES // 2))
+
+# Через сколько дней закрытая задача переносится в холодный архив и размер пачки переноса
+TASK_ARCHIVE_AFTER_DAYS = int(os.getenv("TASK_ARCHIVE_AFTER_DAYS", "30"))
+TASK_ARCHIVE_BATCH_SIZE = int(os.getenv("TASK_ARCHIVE_BATCH_SIZE", "1000"))
+
+# Сколько задач показывать на одной странице /задачи
+BOT_TASK_PAGE_SIZE = int(os.getenv("BOT_TASK_PAGE_SIZE", "10"))
+
+# Сколько минут помнить позицию пользователя в списке задач
+TASK_LIST_CURSOR_TTL_MINUTES = float(os.getenv("TASK_LIST_CURSOR_TTL_MINUTES", "30"))
+
+# Сколько задач можно изменить одной командой
+BULK_TASK_LIMIT = int(os.getenv("BULK_TASK_LIMIT", "100"))
+
+# Сколько id чатов держать в памяти
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "10000"))
+
+# Кэш состояния пользователей: размер и время жизни записи (секунды)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Канал NOTIFY для сброса кэша пользователей между экземплярами
+USER_CACHE_CHANNEL = "user_state_changed"
+
+# Сколько часов переиспользовать загруженное в MAX изображение
+UPLOAD_CACHE_TTL_HOURS = float(os.getenv("UPLOAD_CACHE_TTL_HOURS", "24"))
+
+# Пул соединений клиента загрузки файлов
+UPLOAD_MAX_CONNECTIONS = int(os.getenv("UPLOAD_MAX_CONNECTIONS", "10"))
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "90"))
+
+# Режим нескольких экземпляров: лидер опрашивает API и пишет обновления
+# в таблицу update_queue, обрабатывают ее все экземпляры
+CLUSTER_MODE = os.getenv("CLUSTER_MODE", "0") == "1"
+
+# Ключ advisory lock, которым владеет лидер
+LEADER_LOCK_ID = int(os.getenv("LEADER_LOCK_ID", "7240001"))
+
+# Как часто не-лидер пытается захватить лидерство и лидер проверяет соединение (секунды)
+LEADER_RETRY_INTERVAL = float(os.getenv("LEADER_RETRY_INTERVAL", "10"))
+LEADER_HEARTBEAT_INTERVAL = float(os.getenv("LEADER_HEARTBEAT_INTERVAL", "5"))
+
+# Параметры разбора очереди обновлений в БД
+QUEUE_BATCH_SIZE = int(os.getenv("QUEUE_BATCH_SIZE", "50"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "0.5"))
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", "300"))
+
+# Захват в журнале обновлений должен истекать раньше аренды в update_queue,
+# иначе выданное повторно после сбоя обновление будет пропущено как захваченное
+UPDATE_CLAIM_SECONDS = min(UPDATE_CLAIM_SECONDS, max(1, QUEUE_LEASE_SECONDS // 2))
+
+# Сбои инфраструктуры (БД недоступна, обрыв соединения, таймаут) обработчики
+# команд не перехватывают: обновление не отмечается обработанным и будет
+# обработано повторно
+RETRYABLE_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.CannotConnectNowError,
+)
+
+# Идентификатор экземпляра (для отладки захваченных обновлений)
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
 # Пул соединений с БД (будет инициализирован при запуске)
 db_pool: Optional[asyncpg.Pool] = None
 
 # HTTP клиент для работы с API
 http_client: Optional[httpx.AsyncClient] = None
 
+# HTTP клиент для загрузки файлов (без Authorization, свой пул соединений)
+upload_client: Optional[httpx.AsyncClient] = None
+
 # Планировщик для ритуалов
 scheduler: Optional[AsyncIOScheduler] = None
 
+# Очередь ближайших ритуалов (загружена до ritual_queue_until) и цикл их отправки
+ritual_queue = ritual_schedule.RitualQueue()
+ritual_queue_until: Optional[datetime] = None
+ritual_wakeup = asyncio.Event()
+ritual_engine: Optional[asyncio.Task] = None
+
+# Диспетчер параллельной обработки обновлений
+update_dispatcher: Optional[KeyedDispatcher] = None
+
+# Очередь исходящих сообщений
+outbound_queue: Optional[OutboundQueue] = None
+
+# Фоновый разбор outbox и сигнал о новых сообщениях в нем
+outbox_task: Optional[asyncio.Task] = None
+outbox_wakeup: Optional[asyncio.Event] = None
+
+# Кэш загруженных изображений: хэш содержимого -> (photos, срок действия)
+upload_cache: Dict[str, tuple] = {}
+
+# Загрузки в процессе (чтобы параллельные отправки не грузили одно и то же)
+upload_in_flight: Dict[str, asyncio.Future] = {}
+
+# Изображения в памяти: путь -> (mtime, размер, содержимое, хэш)
+image_buffers: Dict[str, tuple] = {}
+
+# Доступ к задачам и чатам (подготовленные запросы, кэш id чатов)
+repo: Optional[Repository] = None
+
+# Буфер записей самочувствия
+mood_writer: Optional[BatchWriter] = None
+
+# Позиция в списке /задачи: (max_user_id, chat_id) -> (курсор дальше, курсор назад)
+task_list_cursors = LRUCache(USER_CACHE_SIZE, ttl=TASK_LIST_CURSOR_TTL_MINUTES * 60)
+
+# Последний поиск /найти: (max_user_id, chat_id) -> (запрос, курсор дальше)
+task_search_cursors = LRUCache(USER_CACHE_SIZE, ttl=TASK_LIST_CURSOR_TTL_MINUTES * 60)
+
+# Кэш состояния пользователей: max_user_id -> строка users (None - нет в БД)
+user_cache = LRUCache(USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+USER_NOT_CACHED = object()
+
+# Соединение, слушающее сбросы кэша пользователей от других экземпляров
+user_cache_listener: Optional[asyncpg.Connection] = None
+
+# Фоновые задачи "запустил и забыл" (держим ссылки, чтобы их не собрал GC)
+background_tasks: set = set()
+
+# Окно недавно обработанных обновлений (дедупликация без похода в БД)
+processed_updates_window = LRUCache(UPDATE_LEDGER_WINDOW)
+
+# Внутренняя очередь обновлений, принятых через webhook
+webhook_queue: Optional[asyncio.Queue] = None
+webhook_consumer: Optional[asyncio.Task] = None
+webhook_leader: Optional[asyncio.Task] = None
+
 
 # ========== Database Functions ==========
 
 async def init_db_pool():
     """Инициализация пула соединений с БД"""
-    global db_pool
+    global db_pool, repo
     try:
-        db_pool = await asyncpg.create_pool(
+        if RUN_MIGRATIONS:
+            # До создания пула: подготовленные запросы должны видеть новую схему
+            await migrate.apply_migrations(DATABASE_URL)
+        db_pool = await repository.create_pool(
             DATABASE_URL,
             min_size=2,
             max_size=10,
             command_timeout=60
         )
+        repo = Repository(db_pool, CHAT_CACHE_SIZE)
         logger.info("✅ База данных подключена")
     except Exception as e:
         logger.error(f"❌ Ошибка подключения к БД: {e}")
@@ -97,91 +313,288 @@ async def close_http_client():
         logger.info("❌ HTTP клиент закрыт")
 
 
+async def init_upload_client():
+    """Инициализация долгоживущего клиента для загрузки файлов"""
+    global upload_client
+    # Без Authorization заголовка: URL загрузки уже содержит подпись
+    upload_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(UPLOAD_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=UPLOAD_MAX_CONNECTIONS,
+            max_keepalive_connections=UPLOAD_MAX_CONNECTIONS
+        )
+    )
+    logger.info("✅ HTTP клиент загрузки файлов инициализирован")
+
+
+async def close_upload_client():
+    """Закрытие клиента загрузки файлов"""
+    global upload_client
+    if upload_client:
+        await upload_client.aclose()
+        upload_client = None
+        logger.info("❌ HTTP клиент загрузки файлов закрыт")
+
+
 async def get_or_create_chat(max_chat_id: str, name: Optional[str] = None) -> int:
     """Получить или создать чат в БД"""
+    return await repo.get_or_create_chat(max_chat_id, name)
+
+
+async def get_user_tasks(user_id: int, chat_id: str, cursor: Optional[str] = None) -> Page:
+    """Получить страницу активных задач пользователя в чате"""
+    chat_db_id = await get_or_create_chat(chat_id)
+    return await repo.get_user_tasks(chat_db_id, user_id, BOT_TASK_PAGE_SIZE, cursor)
+
+
+async def search_tasks(chat_id: str, query: str, cursor: Optional[str] = None) -> SearchPage:
+    """Найти задачи чата (страница результатов)"""
+    chat_db_id = await get_or_create_chat(chat_id)
+    return await repo.search_tasks(chat_db_id, query, BOT_TASK_PAGE_SIZE, cursor)
+
+
+async def mark_task_completed(task_id: int, user_id: int, conn: Optional[asyncpg.Connection] = None) -> bool:
+    """Отметить задачу как выполненную"""
+    return await repo.complete_user_task(task_id, user_id, conn)
+
+
+async def create_task(
+    user_id: int,
+    chat_id: str,
+    title: str,
+    description: str = "",
+    conn: Optional[asyncpg.Connection] = None
+) -> int:
+    """
+    Создать новую задачу
+
+    Если передано соединение, id чата должен уже быть в кэше (см.
+    handle_create_task): иначе чат создавался бы на втором соединении из
+    пула, пока первое занято транзакцией.
+    """
+    chat_db_id = await get_or_create_chat(chat_id)
+    return await repo.create_task(chat_db_id, user_id, title, description, conn=conn)
+
+
+# ========== Update Ledger Functions ==========
+
+async def load_marker() -> int:
+    """Загрузить последний сохраненный marker long polling"""
     async with db_pool.acquire() as conn:
-        # Пытаемся найти существующий чат
-        row = await conn.fetchrow(
-            "SELECT id FROM chats WHERE max_chat_id = $1",
-            max_chat_id
+        value = await conn.fetchval(
+            "SELECT value FROM bot_state WHERE key = $1",
+            MARKER_STATE_KEY
         )
-        
-        if row:
-            return row['id']
-        
-        # Создаем новый чат
-        row = await conn.fetchrow(
-            "INSERT INTO chats (max_chat_id, name) VALUES ($1, $2) RETURNING id",
-            max_chat_id,
-            name or f"Chat {max_chat_id}"
-        )
-        return row['id']
+    return int(value) if value else 0
 
 
-async def get_user_tasks(user_id: int, chat_id: str) -> List[dict]:
-    """Получить активные задачи пользователя в чате"""
-    chat_db_id = await get_or_create_chat(chat_id)
+async def save_marker(marker: int, conn: Optional[asyncpg.Connection] = None):
+    """Сохранить marker после обработки пачки обновлений"""
+    if conn is None:
+        async with db_pool.acquire() as conn:
+            return await save_marker(marker, conn)
+    
+    await conn.execute("""
+        INSERT INTO bot_state (key, value, updated_at)
+        VALUES ($1, $2, NOW())
+        ON CONFLICT (key) DO UPDATE
+        SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+    """, MARKER_STATE_KEY, str(marker))
+
+
+async def claim_update(update_id: str) -> bool:
+    """
+    Захватить обновление для обработки (аренда на UPDATE_CLAIM_SECONDS)
+
+    Обработанным обновление становится только в complete_update(). Захват,
+    брошенный упавшим процессом, перехватывается после истечения аренды.
+
+    Returns:
+        True, если обновление еще не обработано и никем не обрабатывается
+    """
+    if update_id in processed_updates_window:
+        return False
     
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT 
-                t.id, t.title, t.description, t.tag, 
-                t.status, t.created_at, t.deadline
-            FROM tasks t
-            WHERE t.chat_id = $1 
-                AND (t.creator_id = $2 OR t.assignee_id = $2)
-                AND t.status = 'active'
-            ORDER BY t.deadline ASC NULLS LAST, t.created_at DESC
-        """, chat_db_id, user_id)
-        
-        return [dict(row) for row in rows]
+        row = await conn.fetchrow("""
+            INSERT INTO processed_updates (update_id, claimed_until)
+            VALUES ($1, NOW() + make_interval(secs => $2))
+            ON CONFLICT (update_id) DO UPDATE
+            SET claimed_until = EXCLUDED.claimed_until, processed_at = NOW()
+            WHERE processed_updates.claimed_until < NOW()
+            RETURNING update_id
+        """, update_id, UPDATE_CLAIM_SECONDS)
+    
+    return row is not None
 
 
-async def mark_task_completed(task_id: int, user_id: int) -> bool:
-    """Отметить задачу как выполненную"""
+async def complete_update(update_id: str):
+    """Отметить захваченное обновление обработанным"""
     async with db_pool.acquire() as conn:
-        # Проверяем, что задача существует и пользователь имеет к ней доступ
-        task = await conn.fetchrow("""
-            SELECT id FROM tasks 
-            WHERE id = $1 
-                AND (creator_id = $2 OR assignee_id = $2)
-                AND status = 'active'
-        """, task_id, user_id)
-        
-        if not task:
-            return False
-        
-        # Обновляем статус
         await conn.execute("""
-            UPDATE tasks 
-            SET status = 'completed', completed_at = $1
-            WHERE id = $2
-        """, datetime.now(), task_id)
-        
-        return True
+            UPDATE processed_updates
+            SET claimed_until = NULL, processed_at = NOW()
+            WHERE update_id = $1
+        """, update_id)
+    
+    processed_updates_window.set(update_id, True)
 
 
-async def create_task(user_id: int, chat_id: str, title: str, description: str = "") -> int:
-    """Создать новую задачу"""
-    chat_db_id = await get_or_create_chat(chat_id)
-    
+async def release_update(update_id: str):
+    """Снять захват с обновления, обработка которого прервалась"""
     async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            INSERT INTO tasks (
-                chat_id, creator_id, title, description, status
-            ) VALUES ($1, $2, $3, $4, 'active')
-            RETURNING id
-        """, chat_db_id, user_id, title, description)
-        
-        return row['id']
+        await conn.execute(
+            "DELETE FROM processed_updates WHERE update_id = $1 AND claimed_until IS NOT NULL",
+            update_id
+        )
+
+
+async def release_update_claims():
+    """
+    Снять все незавершенные захваты
+
+    Вызывается при запуске единственного обработчика (long polling без
+    CLUSTER_MODE): обновления, прерванные прошлым процессом, придут повторно
+    с сохраненного marker и не должны ждать истечения аренды.
+    """
+    async with db_pool.acquire() as conn:
+        result = await conn.execute(
+            "DELETE FROM processed_updates WHERE claimed_until IS NOT NULL"
+        )
+    released = int(result.split()[-1])
+    if released:
+        logger.info(f"🔓 Сняты незавершенные захваты обновлений: {released}")
+
+
+async def enqueue_updates_to_table(updates: List[Dict[str, Any]], marker: int):
+    """Записать пачку обновлений в update_queue вместе с marker (одна транзакция)"""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany("""
+                INSERT INTO update_queue (order_key, payload)
+                VALUES ($1, $2::jsonb)
+            """, [(get_update_key(update), json.dumps(update)) for update in updates])
+            await save_marker(marker, conn)
+
+
+async def claim_queued_updates(limit: int) -> List[asyncpg.Record]:
+    """
+    Захватить обновления из update_queue для обработки этим экземпляром
+
+    Берутся только обновления, перед которыми нет более ранних записей с тем же
+    ключом - так порядок по пользователю сохраняется между экземплярами.
+    Захват - это аренда на QUEUE_LEASE_SECONDS: если экземпляр упадет,
+    обновления снова станут доступны другим.
+    """
+    async with db_pool.acquire() as conn:
+        return await conn.fetch("""
+            UPDATE update_queue q
+            SET locked_until = NOW() + make_interval(secs => $2), locked_by = $3,
+                attempts = q.attempts + 1
+            WHERE q.id IN (
+                SELECT c.id
+                FROM update_queue c
+                WHERE (c.locked_until IS NULL OR c.locked_until < NOW())
+                  AND NOT EXISTS (
+                      SELECT 1 FROM update_queue e
+                      WHERE e.order_key = c.order_key AND e.id < c.id
+                  )
+                ORDER BY c.id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING q.id, q.order_key, q.payload, q.attempts
+        """, limit, QUEUE_LEASE_SECONDS, INSTANCE_ID)
+
+
+async def delete_queued_updates(ids: List[int]):
+    """Удалить обработанные обновления из update_queue"""
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM update_queue WHERE id = ANY($1::bigint[])",
+            ids
+        )
+
+
+async def prune_processed_updates():
+    """Удалить из журнала старые записи об обработанных обновлениях"""
+    try:
+        async with db_pool.acquire() as conn:
+            result = await conn.execute("""
+                DELETE FROM processed_updates
+                WHERE processed_at < NOW() - make_interval(hours => $1)
+            """, UPDATE_LEDGER_RETENTION_HOURS)
+        logger.info(f"🧹 Очистка журнала обновлений: {result}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка очистки журнала обновлений: {e}")
+
+
+# ========== Storage Retention ==========
+
+async def run_storage_retention():
+    """
+    Обслуживание холодных данных
+
+    Создает секции mood_logs на месяцы вперед, сворачивает старые секции
+    в дневные агрегаты mood_daily и удаляет их, переносит давно закрытые
+    задачи в tasks_archive.
+    """
+    try:
+        async with db_pool.acquire() as conn:
+            created = await conn.fetchval(
+                "SELECT ensure_mood_log_partitions($1)",
+                MOOD_PARTITIONS_AHEAD
+            )
+            compacted = await conn.fetchval(
+                "SELECT compact_mood_log_partitions($1)",
+                MOOD_RAW_RETENTION_MONTHS
+            )
+        moved = await repo.archive_closed_tasks(TASK_ARCHIVE_AFTER_DAYS, TASK_ARCHIVE_BATCH_SIZE)
+        logger.info(
+            f"🧹 Хранение данных: новых секций mood_logs {created}, "
+            f"свернуто {compacted}, задач в архив {moved}"
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка обслуживания хранения данных: {e}")
 
 
 # ========== User Management Functions ==========
 
+# Колонки расписания ритуалов не кэшируются: планировщик обновляет их пачками
+# в обход кэша, а читаются они только из БД
+USER_UNCACHED_COLUMNS = ("next_ritual_at", "next_ritual_type")
+
+
+def cache_user(user_id: int, row: Optional[asyncpg.Record]) -> Optional[dict]:
+    """Положить состояние пользователя в кэш (None - пользователя нет в БД)"""
+    user = None
+    if row:
+        user = {key: value for key, value in row.items() if key not in USER_UNCACHED_COLUMNS}
+    user_cache.set(user_id, user)
+    return dict(user) if user else None
+
+
+def store_user(user_id: int, row: Optional[asyncpg.Record]) -> Optional[dict]:
+    """
+    Записать в кэш строку, измененную этим экземпляром, и сообщить другим
+
+    Write-through: кэш получает актуальную строку из RETURNING, остальные
+    экземпляры сбрасывают свою копию.
+    """
+    user = cache_user(user_id, row)
+    publish_user_invalidation(user_id)
+    return user
+
+
 async def get_or_create_user(user_id: int, first_name: str = "", last_name: str = "") -> dict:
     """Получить или создать пользователя"""
     logger.info(f"🔍 get_or_create_user для user_id={user_id}, name={first_name}")
     
+    cached = user_cache.get(user_id, USER_NOT_CACHED)
+    if cached is not USER_NOT_CACHED and cached is not None:
+        logger.info(f"✅ Пользователь {user_id} найден в кэше")
+        return dict(cached)
+    
     async with db_pool.acquire() as conn:
         # Пытаемся найти пользователя
         row = await conn.fetchrow(
@@ -191,7 +604,7 @@ async def get_or_create_user(user_id: int, first_name: str = "", last_name: str
         
         if row:
             logger.info(f"✅ Пользователь {user_id} найден в БД")
-            return dict(row)
+            return cache_user(user_id, row)
         
         logger.info(f"➕ Создаём нового пользователя {user_id}")
         
@@ -204,7 +617,7 @@ async def get_or_create_user(user_id: int, first_name: str = "", last_name: str
             """, user_id, first_name, last_name)
             
             logger.info(f"✅ Пользователь {user_id} создан")
-            return dict(row)
+            return store_user(user_id, row)
         except Exception as e:
             logger.error(f"❌ Ошибка создания пользователя: {e}")
             import traceback
@@ -215,11 +628,15 @@ async def get_or_create_user(user_id: int, first_name: str = "", last_name: str
 async def update_user_onboarding(user_id: int, step: str):
     """Обновить шаг онбординга пользователя"""
     async with db_pool.acquire() as conn:
-        await conn.execute("""
+        row = await conn.fetchrow("""
             UPDATE users 
             SET onboarding_step = $1, updated_at = NOW()
             WHERE max_user_id = $2
+            RETURNING *
         """, step, user_id)
+        row = await reschedule_user_rituals(conn, row)
+    
+    store_user(user_id, row)
 
 
 async def update_user_ritual_time(user_id: int, ritual_type: str, time_str: str):
@@ -235,48 +652,225 @@ async def update_user_ritual_time(user_id: int, ritual_type: str, time_str: str)
     
     async with db_pool.acquire() as conn:
         if ritual_type == "morning":
-            result = await conn.execute("""
+            row = await conn.fetchrow("""
                 UPDATE users 
                 SET morning_ritual_time = $1, updated_at = NOW()
                 WHERE max_user_id = $2
+                RETURNING *
             """, time_obj, user_id)
-            logger.info(f"🔍 Результат UPDATE morning: {result}")
         else:  # evening
-            result = await conn.execute("""
+            row = await conn.fetchrow("""
                 UPDATE users 
                 SET evening_ritual_time = $1, updated_at = NOW()
                 WHERE max_user_id = $2
+                RETURNING *
             """, time_obj, user_id)
-            logger.info(f"🔍 Результат UPDATE evening: {result}")
+        logger.info(f"🔍 Результат UPDATE {ritual_type}: {'OK' if row else 'пользователь не найден'}")
+        row = await reschedule_user_rituals(conn, row)
+    
+    store_user(user_id, row)
+
+
+async def reschedule_user_rituals(conn: asyncpg.Connection, row: Optional[asyncpg.Record]) -> Optional[asyncpg.Record]:
+    """Пересчитать ближайший ритуал после изменения настроек пользователя"""
+    if row is None:
+        return None
+    
+    scheduled = ritual_schedule.next_ritual(dict(row), datetime.now(timezone.utc))
+    next_at, next_type = scheduled or (None, None)
+    if row['next_ritual_at'] == next_at and row['next_ritual_type'] == next_type:
+        return row
+    
+    row = await conn.fetchrow("""
+        UPDATE users
+        SET next_ritual_at = $1, next_ritual_type = $2
+        WHERE max_user_id = $3
+        RETURNING *
+    """, next_at, next_type, row['max_user_id'])
+    queue_user_ritual(row['max_user_id'], next_at)
+    return row
+
+
+async def update_user_timezone(user_id: int, zone_name: str):
+    """Обновить часовой пояс пользователя и пересчитать ближайший ритуал"""
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            UPDATE users 
+            SET timezone = $1, updated_at = NOW()
+            WHERE max_user_id = $2
+            RETURNING *
+        """, zone_name, user_id)
+        row = await reschedule_user_rituals(conn, row)
+    
+    store_user(user_id, row)
+
+
+def log_mood(user_id: int, mood_level: int, ritual_type: str):
+    """Записать самочувствие пользователя (в буфер, запись в БД пачками)"""
+    mood_writer.add((user_id, mood_level, ritual_type, datetime.now(timezone.utc)))
+
 
+# ========== Mood Writer ==========
 
-async def log_mood(user_id: int, mood_level: int, ritual_type: str):
-    """Записать самочувствие пользователя"""
+async def write_mood_logs(records: List[tuple]):
+    """
+    Записать пачку ответов о самочувствии одним запросом
+
+    Тем же запросом обновляются дневные агрегаты mood_daily, из которых
+    строится статистика. Записи пользователей, которых нет в users,
+    пропускаются, чтобы одна такая запись не отклоняла всю пачку по
+    внешнему ключу.
+    """
+    user_ids, mood_levels, ritual_types, logged_at = zip(*records)
     async with db_pool.acquire() as conn:
         await conn.execute("""
-            INSERT INTO mood_logs (user_id, mood_level, ritual_type)
-            VALUES ($1, $2, $3)
-        """, user_id, mood_level, ritual_type)
+            WITH inserted AS (
+                INSERT INTO mood_logs (user_id, mood_level, ritual_type, logged_at)
+                SELECT m.user_id, m.mood_level, m.ritual_type, m.logged_at
+                FROM unnest($1::bigint[], $2::int[], $3::text[], $4::timestamptz[])
+                    AS m(user_id, mood_level, ritual_type, logged_at)
+                WHERE EXISTS (SELECT 1 FROM users u WHERE u.max_user_id = m.user_id)
+                RETURNING user_id, mood_level, ritual_type, logged_at
+            )
+            INSERT INTO mood_daily (user_id, day, ritual_type, entries, mood_sum, level_counts)
+            SELECT
+                user_id,
+                (logged_at AT TIME ZONE 'UTC')::date,
+                ritual_type,
+                COUNT(*),
+                SUM(mood_level),
+                ARRAY[
+                    COUNT(*) FILTER (WHERE mood_level = 1), COUNT(*) FILTER (WHERE mood_level = 2),
+                    COUNT(*) FILTER (WHERE mood_level = 3), COUNT(*) FILTER (WHERE mood_level = 4),
+                    COUNT(*) FILTER (WHERE mood_level = 5), COUNT(*) FILTER (WHERE mood_level = 6),
+                    COUNT(*) FILTER (WHERE mood_level = 7)
+                ]::INT[]
+            FROM inserted
+            GROUP BY 1, 2, 3
+            ON CONFLICT (user_id, day, ritual_type) DO UPDATE SET
+                entries = mood_daily.entries + EXCLUDED.entries,
+                mood_sum = mood_daily.mood_sum + EXCLUDED.mood_sum,
+                level_counts = ARRAY(
+                    SELECT old_count + new_count
+                    FROM unnest(mood_daily.level_counts, EXCLUDED.level_counts) AS c(old_count, new_count)
+                )
+        """, list(user_ids), list(mood_levels), list(ritual_types), list(logged_at))
+
+
+async def init_mood_writer():
+    """Запуск буферизованной записи самочувствия"""
+    global mood_writer
+    mood_writer = BatchWriter(
+        write_mood_logs,
+        max_batch=MOOD_BATCH_SIZE,
+        max_delay=MOOD_FLUSH_INTERVAL,
+        max_pending=MOOD_BUFFER_LIMIT,
+        name="mood_logs"
+    )
+    mood_writer.start()
+    logger.info("✅ Запись самочувствия пачками запущена")
+
+
+async def close_mood_writer():
+    """Остановка записи самочувствия с сохранением буфера"""
+    global mood_writer
+    if mood_writer:
+        await mood_writer.close()
+        mood_writer = None
+        logger.info("❌ Запись самочувствия остановлена")
 
 
 async def get_user(user_id: int) -> Optional[dict]:
-    """Получить пользователя по ID"""
+    """Получить пользователя по ID (из кэша, если он свежий)"""
+    cached = user_cache.get(user_id, USER_NOT_CACHED)
+    if cached is not USER_NOT_CACHED:
+        return dict(cached) if cached else None
+    
     async with db_pool.acquire() as conn:
         row = await conn.fetchrow(
             "SELECT * FROM users WHERE max_user_id = $1",
             user_id
         )
-        return dict(row) if row else None
+    return cache_user(user_id, row)
+
+
+# ========== User Cache Invalidation ==========
+
+def publish_user_invalidation(user_id: int):
+    """
+    Сообщить другим экземплярам, что состояние пользователя изменилось
+
+    Нужно только в режиме нескольких экземпляров: обновления одного
+    пользователя могут обрабатываться разными узлами.
+    """
+    if not CLUSTER_MODE or user_cache_listener is None:
+        return
+    
+    task = asyncio.create_task(notify_user_invalidation(user_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def notify_user_invalidation(user_id: int):
+    """Отправить NOTIFY об изменении пользователя"""
+    try:
+        async with db_pool.acquire() as conn:
+            await conn.execute(
+                "SELECT pg_notify($1, $2)",
+                USER_CACHE_CHANNEL,
+                f"{INSTANCE_ID}|{user_id}"
+            )
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось разослать сброс кэша пользователя {user_id}: {e}")
+
+
+def on_user_invalidation(connection, pid, channel, payload):
+    """Обработать NOTIFY об изменении пользователя на другом экземпляре"""
+    instance_id, _, user_id = payload.rpartition("|")
+    if instance_id != INSTANCE_ID and user_id.isdigit():
+        user_cache.pop(int(user_id))
+        if ritual_engine is not None:
+            # Настройки ритуалов могли измениться - перечитываем время в очереди
+            task = asyncio.create_task(refresh_user_ritual(int(user_id)))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+
+async def init_user_cache_listener():
+    """Подписаться на сбросы кэша пользователей (режим нескольких экземпляров)"""
+    global user_cache_listener
+    if not CLUSTER_MODE:
+        return
+    
+    try:
+        user_cache_listener = await asyncpg.connect(DATABASE_URL)
+        await user_cache_listener.add_listener(USER_CACHE_CHANNEL, on_user_invalidation)
+        logger.info("✅ Подписка на сброс кэша пользователей")
+    except Exception as e:
+        # Без подписки кэш все равно устаревает по TTL
+        logger.error(f"❌ Не удалось подписаться на сброс кэша пользователей: {e}")
+        user_cache_listener = None
+
+
+async def close_user_cache_listener():
+    """Отписаться от сбросов кэша пользователей"""
+    global user_cache_listener
+    if user_cache_listener:
+        await asyncio.gather(user_cache_listener.close(), return_exceptions=True)
+        user_cache_listener = None
 
 
 # ========== Helper Functions ==========
 
-def format_task_list(tasks: List[dict]) -> str:
-    """Форматировать список задач для вывода"""
+def format_task_list(tasks: List[dict], has_next: bool = False, has_prev: bool = False) -> str:
+    """Форматировать страницу списка задач для вывода"""
     if not tasks:
         return "📝 У вас нет активных задач"
     
-    lines = [f"📋 Ваши активные задачи ({len(tasks)}):"]
+    if has_next or has_prev:
+        lines = [f"📋 Ваши активные задачи (на странице: {len(tasks)}):"]
+    else:
+        lines = [f"📋 Ваши активные задачи ({len(tasks)}):"]
     lines.append("")
     
     for i, task in enumerate(tasks, 1):
@@ -301,9 +895,118 @@ def format_task_list(tasks: List[dict]) -> str:
         
         lines.append("")
     
+    # Навигация по страницам
+    if has_prev:
+        lines.append("⬅️ /задачи назад - предыдущая страница")
+    if has_next:
+        lines.append("➡️ /задачи дальше - следующая страница")
+    
+    return "\n".join(lines).strip()
+
+
+def format_search_results(query: str, page: SearchPage) -> str:
+    """Форматировать страницу результатов поиска для вывода"""
+    if not page.items:
+        return f"🔍 По запросу «{query}» ничего не найдено"
+
+    status_icons = {'active': '🟢', 'completed': '✅', 'archived': '📦'}
+    if page.mode == 'fuzzy':
+        lines = [f"🔍 Точных совпадений с «{query}» нет, похожие задачи:"]
+    else:
+        lines = [f"🔍 Найдено по запросу «{query}»:"]
+    lines.append("")
+
+    for i, task in enumerate(page.items, 1):
+        icon = status_icons.get(task['status'], '•')
+        lines.append(f"{i}. {icon} [{task['id']}] {task['title']}")
+        if task.get('tag'):
+            lines.append(f"   🏷️ {task['tag']}")
+        if task.get('deadline'):
+            lines.append(f"   ⏰ {task['deadline'].strftime('%d.%m.%Y %H:%M')}")
+        lines.append("")
+
+    if page.next_cursor:
+        lines.append("➡️ /найти дальше - следующие результаты")
+
     return "\n".join(lines).strip()
 
 
+def format_mood_stats(stats: Dict[str, dict]) -> str:
+    """Форматировать статистику самочувствия для вывода"""
+    if not stats["month"]["entries"]:
+        return (
+            "📊 Пока нет записей о самочувствии за последний месяц\n"
+            "Отвечайте на вопросы утреннего и вечернего ритуалов - статистика появится здесь"
+        )
+    
+    lines = ["📊 Ваше самочувствие", ""]
+    for title, period in (("За неделю", stats["week"]), ("За месяц", stats["month"])):
+        if not period["entries"]:
+            lines.append(f"{title}: нет записей")
+            lines.append("")
+            continue
+        
+        lines.append(f"{title}: в среднем {period['average']} ({period['entries']} ответов)")
+        for ritual, label in (("morning", "🌅 Утро"), ("evening", "🌙 Вечер")):
+            ritual_stats = period[ritual]
+            if ritual_stats["entries"]:
+                lines.append(f"   {label}: {ritual_stats['average']} ({ritual_stats['entries']})")
+        lines.append("")
+    
+    lines.append("Распределение за месяц:")
+    for level, count in stats["month"]["levels"].items():
+        if count:
+            lines.append(f"   {level}. {ritual_config.get_mood_description(level)}: {count}")
+    
+    return "\n".join(lines).strip()
+
+
+def parse_task_ids(text: str) -> List[int]:
+    """
+    Разобрать список ID задач: "3 5 8", "3, 5, 8", "3-7"
+
+    Returns:
+        ID задач без повторов в порядке упоминания (пустой список, если
+        в тексте есть что-то кроме номеров и диапазонов)
+    """
+    task_ids: List[int] = []
+    for part in re.split(r'[\s,]+', text.strip()):
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d+)(?:-(\d+))?', part)
+        if not match:
+            return []
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if last < first or last - first >= BULK_TASK_LIMIT:
+            return []
+        task_ids.extend(range(first, last + 1))
+    return list(dict.fromkeys(task_ids))
+
+
+def format_completion_report(task_ids: List[int], completed: set) -> str:
+    """Сообщение с результатом /готово по каждой задаче"""
+    if len(task_ids) == 1:
+        task_id = task_ids[0]
+        if completed:
+            return f"✅ Задача #{task_id} отмечена как выполненная!"
+        return (
+            f"⚠️ Задача #{task_id} не найдена или уже выполнена\n"
+            f"Используйте /задачи для просмотра активных задач"
+        )
+    
+    done = [f"#{task_id}" for task_id in task_ids if task_id in completed]
+    missing = [f"#{task_id}" for task_id in task_ids if task_id not in completed]
+    
+    lines = []
+    if done:
+        lines.append(f"✅ Отмечены как выполненные ({len(done)}): {', '.join(done)}")
+    if missing:
+        lines.append(f"⚠️ Не найдены или уже выполнены ({len(missing)}): {', '.join(missing)}")
+        lines.append("Используйте /задачи для просмотра активных задач")
+    return "\n".join(lines)
+
+
 def extract_user_and_chat_id(message: Dict[str, Any]) -> tuple:
     """Извлечь ID пользователя и чата из сообщения"""
     # MAX API структура:
@@ -329,23 +1032,39 @@ def extract_user_and_chat_id(message: Dict[str, Any]) -> tuple:
     return int(user_id), str(chat_id)
 
 
+async def throttle_api_call():
+    """Взять токен общего лимита MAX API на один запрос (если очередь запущена)"""
+    if outbound_queue is not None:
+        await outbound_queue.throttle()
+
+
+async def post_message(user_id: int, payload: dict) -> httpx.Response:
+    """Выполнить запрос отправки сообщения в MAX API"""
+    await throttle_api_call()
+    return await http_client.post(
+        f"{BASE_URL}/messages",
+        params={"user_id": user_id},
+        json=payload
+    )
+
+
 async def send_message(user_id: int, text: str) -> bool:
-    """Отправить сообщение пользователю"""
+    """
+    Отправить сообщение пользователю
+
+    Сообщение ставится в очередь исходящих и уходит с учетом лимитов API,
+    ошибки 429/5xx повторяются автоматически.
+
+    Returns:
+        True, если сообщение поставлено в очередь
+    """
+    payload = {"text": text, "notify": True}
+    
     try:
-        url = f"{BASE_URL}/messages"
-        params = {"user_id": user_id}
-        payload = {"text": text, "notify": True}
-        
-        response = await http_client.post(url, params=params, json=payload)
-        
-        if response.status_code == 200:
-            return True
-        else:
-            logger.error(f"❌ Ошибка отправки сообщения: {response.status_code} - {response.text}")
-            return False
-            
+        await outbound_queue.put(user_id, lambda: post_message(user_id, payload))
+        return True
     except Exception as e:
-        logger.error(f"❌ Ошибка при отправке сообщения: {e}")
+        logger.error(f"❌ Ошибка при постановке сообщения в очередь: {e}")
         return False
 
 
@@ -364,6 +1083,7 @@ async def upload_image_to_max(image_path: str) -> Optional[dict]:
         upload_url_endpoint = f"{BASE_URL}/uploads"
         params = {"type": "image"}
         
+        await throttle_api_call()
         response = await http_client.post(upload_url_endpoint, params=params)
         
         if response.status_code != 200:
@@ -380,11 +1100,11 @@ async def upload_image_to_max(image_path: str) -> Optional[dict]:
         logger.info(f"✅ Получен URL для загрузки")
         
         # Шаг 2: Загрузить файл по полученному URL
-        with open(image_path, 'rb') as f:
-            files = {'data': f}
-            # Создаём отдельный клиент без Authorization заголовка для загрузки файла
-            async with httpx.AsyncClient(timeout=httpx.Timeout(90.0)) as upload_client:
-                upload_response = await upload_client.post(upload_url, files=files)
+        # Содержимое берется из буфера в памяти, multipart тело отдается потоком
+        content, _ = await load_image(image_path)
+        content_type = mimetypes.guess_type(image_path)[0] or "application/octet-stream"
+        files = {'data': (os.path.basename(image_path), content, content_type)}
+        upload_response = await upload_client.post(upload_url, files=files)
         
         if upload_response.status_code != 200:
             logger.error(f"❌ Ошибка загрузки файла: {upload_response.status_code} - {upload_response.text}")
@@ -415,38 +1135,167 @@ async def upload_image_to_max(image_path: str) -> Optional[dict]:
         return None
 
 
-async def send_message_with_image(user_id: int, text: str, image_path: str) -> bool:
-    """
-    Отправить сообщение с изображением пользователю
+# ========== Upload Cache ==========
+
+def read_image_if_changed(image_path: str, cached: Optional[tuple]) -> tuple:
+    """Прочитать файл, если он изменился с момента кэширования (вызывается вне event loop)"""
+    stat = os.stat(image_path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached
     
-    Args:
-        user_id: ID пользователя
-        text: Текст сообщения
-        image_path: Путь к файлу изображения
-        
+    content = Path(image_path).read_bytes()
+    return (stat.st_mtime, stat.st_size, content, hashlib.sha256(content).hexdigest())
+
+
+async def load_image(image_path: str) -> tuple:
+    """
+    Получить содержимое и хэш изображения из буфера в памяти
+
+    Чтение файла выполняется в пуле потоков и только при изменении файла.
+
     Returns:
-        True если сообщение отправлено успешно
+        (содержимое, хэш)
     """
+    entry = await asyncio.to_thread(read_image_if_changed, image_path, image_buffers.get(image_path))
+    image_buffers[image_path] = entry
+    return entry[2], entry[3]
+
+
+async def preload_ritual_images():
+    """Заранее загрузить в память изображения ритуалов"""
+    for ritual in ritual_config.RITUALS.values():
+        try:
+            await load_image(ritual["image_path"])
+        except OSError as e:
+            logger.warning(f"⚠️ Не удалось прочитать изображение ритуала: {e}")
+
+
+async def load_cached_upload(digest: str) -> Optional[dict]:
+    """Найти действующую загрузку изображения в памяти или в БД"""
+    now = datetime.now(timezone.utc)
+    
+    cached = upload_cache.get(digest)
+    if cached:
+        photos, expires_at = cached
+        if expires_at > now:
+            return photos
+        upload_cache.pop(digest, None)
+    
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT payload, expires_at FROM upload_cache
+            WHERE content_hash = $1 AND expires_at > NOW()
+        """, digest)
+    
+    if not row:
+        return None
+    
+    photos = json.loads(row['payload'])
+    upload_cache[digest] = (photos, row['expires_at'])
+    return photos
+
+
+async def store_cached_upload(digest: str, photos: dict):
+    """Сохранить результат загрузки изображения в памяти и в БД"""
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=UPLOAD_CACHE_TTL_HOURS)
+    upload_cache[digest] = (photos, expires_at)
+    
+    async with db_pool.acquire() as conn:
+        await conn.execute("""
+            INSERT INTO upload_cache (content_hash, payload, expires_at)
+            VALUES ($1, $2::jsonb, $3)
+            ON CONFLICT (content_hash) DO UPDATE
+            SET payload = EXCLUDED.payload,
+                created_at = NOW(),
+                expires_at = EXCLUDED.expires_at
+        """, digest, json.dumps(photos), expires_at)
+
+
+# Признаки в ответе 400, что API отклонило само вложение (токен загрузки
+# недействителен или устарел), а не сообщение или получателя
+ATTACHMENT_ERROR_MARKERS = ("attachment", "token", "photo")
+
+
+def is_attachment_rejected(response: httpx.Response) -> bool:
+    """Отклонило ли API вложение сообщения"""
+    if response.status_code != 400:
+        return False
+    body = response.text.lower()
+    return any(marker in body for marker in ATTACHMENT_ERROR_MARKERS)
+
+
+async def invalidate_cached_upload(digest: str):
+    """Забыть загрузку, которую отклонил API"""
+    upload_cache.pop(digest, None)
+    async with db_pool.acquire() as conn:
+        await conn.execute("DELETE FROM upload_cache WHERE content_hash = $1", digest)
+
+
+async def get_image_photos(image_path: str) -> Optional[dict]:
+    """
+    Получить структуру photos для изображения, загрузив его только при необходимости
+
+    Параллельные запросы одного и того же изображения ждут одну общую загрузку.
+    """
+    _, digest = await load_image(image_path)
+    
+    try:
+        photos = await load_cached_upload(digest)
+        if photos:
+            return photos
+    except Exception as e:
+        logger.warning(f"⚠️ Кэш загрузок недоступен: {e}")
+    
+    in_flight = upload_in_flight.get(digest)
+    if in_flight:
+        return await asyncio.shield(in_flight)
+    
+    in_flight = upload_in_flight[digest] = asyncio.get_running_loop().create_future()
     try:
-        # Проверяем существование файла
-        if not os.path.exists(image_path):
-            logger.error(f"❌ Файл не найден: {image_path}")
-            # Отправляем хотя бы текст
-            return await send_message(user_id, text)
-        
-        # Загружаем изображение и получаем структуру photos
         photos = await upload_image_to_max(image_path)
+        if photos:
+            try:
+                await store_cached_upload(digest, photos)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось сохранить загрузку в кэш: {e}")
+        in_flight.set_result(photos)
+        return photos
+    except BaseException:
+        in_flight.set_result(None)
+        raise
+    finally:
+        upload_in_flight.pop(digest, None)
+
+
+async def post_message_with_image(user_id: int, text: str, image_path: str) -> httpx.Response:
+    """
+    Отправить сообщение с изображением, используя кэш загрузок
+
+    Если изображение недоступно или отклонено API, отправляется только текст.
+    Ответы 429/5xx возвращаются как есть, чтобы очередь повторила попытку.
+    """
+    payload = {"text": text, "notify": True}
+    
+    # Проверяем, что файл доступен (читается из буфера в памяти)
+    try:
+        _, digest = await load_image(image_path)
+    except OSError:
+        logger.error(f"❌ Файл не найден: {image_path}")
+        # Отправляем хотя бы текст
+        return await post_message(user_id, payload)
+    
+    # Повторная попытка с новой загрузкой, если API отклонит закэшированную
+    for attempt in range(2):
+        # Берем структуру photos из кэша или загружаем изображение
+        photos = await get_image_photos(image_path)
         
         if not photos:
             logger.warning(f"⚠️ Не удалось загрузить изображение, отправляем только текст")
-            return await send_message(user_id, text)
+            return await post_message(user_id, payload)
         
         # Отправляем сообщение с вложением
-        url = f"{BASE_URL}/messages"
-        params = {"user_id": user_id}
-        payload = {
-            "text": text,
-            "notify": True,
+        response = await post_message(user_id, {
+            **payload,
             "attachments": [
                 {
                     "type": "image",
@@ -455,75 +1304,326 @@ async def send_message_with_image(user_id: int, text: str, image_path: str) -> b
                     }
                 }
             ]
-        }
-        
-        response = await http_client.post(url, params=params, json=payload)
+        })
         
         if response.status_code == 200:
             logger.info(f"✅ Сообщение с изображением отправлено пользователю {user_id}")
-            return True
-        else:
-            logger.error(f"❌ Ошибка отправки сообщения с изображением: {response.status_code} - {response.text}")
-            # Пробуем отправить хотя бы текст
-            return await send_message(user_id, text)
-            
+            return response
+        if is_retryable(response):
+            return response
+        
+        logger.error(f"❌ Ошибка отправки сообщения с изображением: {response.status_code} - {response.text}")
+        if not is_attachment_rejected(response):
+            # Ошибка не связана с вложением (например, пользователь заблокировал
+            # бота) - общая загрузка остается в кэше
+            return response
+        if attempt == 0:
+            # Загрузка могла устареть - забываем ее и загружаем заново
+            try:
+                await invalidate_cached_upload(digest)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось удалить загрузку из кэша: {e}")
+    
+    # Пробуем отправить хотя бы текст
+    return await post_message(user_id, payload)
+
+
+async def send_message_with_image(user_id: int, text: str, image_path: str) -> bool:
+    """
+    Отправить сообщение с изображением пользователю
+    
+    Args:
+        user_id: ID пользователя
+        text: Текст сообщения
+        image_path: Путь к файлу изображения
+        
+    Returns:
+        True, если сообщение поставлено в очередь
+    """
+    try:
+        await outbound_queue.put(
+            user_id,
+            lambda: post_message_with_image(user_id, text, image_path)
+        )
+        return True
     except Exception as e:
-        logger.error(f"❌ Ошибка при отправке сообщения с изображением: {e}")
-        import traceback
-        traceback.print_exc()
-        # Пробуем отправить хотя бы текст
-        return await send_message(user_id, text)
+        logger.error(f"❌ Ошибка при постановке сообщения с изображением в очередь: {e}")
+        return False
+
+
+# ========== Outbound Queue ==========
+
+async def init_outbound_queue():
+    """Инициализация очереди исходящих сообщений"""
+    global outbound_queue
+    outbound_queue = OutboundQueue(
+        workers=OUTBOUND_WORKERS,
+        global_rate=MAX_API_RPS,
+        global_burst=MAX_API_BURST,
+        recipient_rate=RECIPIENT_RPS,
+        recipient_burst=RECIPIENT_BURST,
+        max_attempts=OUTBOUND_MAX_ATTEMPTS,
+        max_pending=OUTBOUND_QUEUE_SIZE
+    )
+    logger.info(
+        f"✅ Очередь исходящих запущена "
+        f"(воркеров: {OUTBOUND_WORKERS}, лимит: {MAX_API_RPS} запр/с)"
+    )
+
+
+async def close_outbound_queue():
+    """Отправить оставшиеся сообщения и остановить очередь исходящих"""
+    global outbound_queue
+    if outbound_queue:
+        await outbound_queue.join(timeout=OUTBOUND_SHUTDOWN_TIMEOUT)
+        await outbound_queue.close()
+        outbound_queue = None
+        logger.info("❌ Очередь исходящих остановлена")
+
+
+# ========== Outbox ==========
+
+async def add_outbox_message(conn: asyncpg.Connection, user_id: int, text: str):
+    """
+    Записать исходящее сообщение в outbox
+
+    Вызывается в транзакции вместе с изменением данных: сообщение будет
+    доставлено тогда и только тогда, когда изменение зафиксировано.
+    """
+    await conn.execute("""
+        INSERT INTO outbox (user_id, payload)
+        VALUES ($1, $2::jsonb)
+    """, user_id, json.dumps({"text": text, "notify": True}))
+
+
+def notify_outbox():
+    """Разбудить разбор outbox сразу после коммита"""
+    if outbox_wakeup:
+        outbox_wakeup.set()
+
+
+async def claim_outbox_messages(limit: int) -> List[asyncpg.Record]:
+    """Захватить пачку сообщений outbox, готовых к отправке"""
+    async with db_pool.acquire() as conn:
+        return await conn.fetch("""
+            UPDATE outbox o
+            SET attempts = o.attempts + 1,
+                next_attempt_at = NOW() + make_interval(secs => $2)
+            WHERE o.id IN (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING o.id, o.user_id, o.payload, o.attempts
+        """, limit, OUTBOX_LEASE_SECONDS)
+
+
+async def complete_outbox_messages(rows: List[asyncpg.Record], results: list):
+    """Записать результаты доставки: отправлено, повтор позже или окончательная ошибка"""
+    sent_ids = [row['id'] for row, result in zip(rows, results) if result is True]
+    failed = [row for row, result in zip(rows, results) if result is not True]
+    
+    async with db_pool.acquire() as conn:
+        if sent_ids:
+            await conn.execute("""
+                UPDATE outbox SET status = 'sent', sent_at = NOW(), last_error = NULL
+                WHERE id = ANY($1::bigint[])
+            """, sent_ids)
+        
+        if failed:
+            await conn.executemany("""
+                UPDATE outbox
+                SET status = CASE WHEN attempts >= $2 THEN 'failed' ELSE 'pending' END,
+                    next_attempt_at = NOW() + make_interval(secs => LEAST(3600, 5 * power(2, attempts))),
+                    last_error = $3
+                WHERE id = $1
+            """, [
+                (row['id'], OUTBOX_MAX_ATTEMPTS, str(result) if isinstance(result, Exception) else "delivery failed")
+                for row, result in zip(rows, results)
+                if result is not True
+            ])
+            logger.warning(f"⚠️ Не доставлено сообщений из outbox: {len(failed)}")
+
+
+async def deliver_outbox_batch() -> int:
+    """Отправить одну пачку сообщений из outbox через очередь исходящих"""
+    rows = await claim_outbox_messages(OUTBOX_BATCH_SIZE)
+    if not rows:
+        return 0
+    
+    futures = []
+    for row in rows:
+        user_id = row['user_id']
+        payload = json.loads(row['payload'])
+        futures.append(await outbound_queue.put(
+            user_id,
+            lambda user_id=user_id, payload=payload: post_message(user_id, payload)
+        ))
+    
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    await complete_outbox_messages(rows, results)
+    return len(rows)
+
+
+async def run_outbox_dispatcher():
+    """Фоновый разбор outbox (безопасно на нескольких экземплярах благодаря SKIP LOCKED)"""
+    logger.info("📤 Разбор outbox запущен")
+    
+    while True:
+        try:
+            outbox_wakeup.clear()
+            delivered = await deliver_outbox_batch()
+            if delivered:
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка разбора outbox: {e}")
+        
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def init_outbox_dispatcher():
+    """Запуск фонового разбора outbox"""
+    global outbox_task, outbox_wakeup
+    outbox_wakeup = asyncio.Event()
+    outbox_task = asyncio.create_task(run_outbox_dispatcher())
+
+
+async def close_outbox_dispatcher():
+    """Остановка фонового разбора outbox"""
+    global outbox_task
+    if outbox_task:
+        outbox_task.cancel()
+        await asyncio.gather(outbox_task, return_exceptions=True)
+        outbox_task = None
+        logger.info("❌ Разбор outbox остановлен")
+
+
+async def prune_outbox():
+    """Удалить давно отправленные сообщения из outbox"""
+    try:
+        async with db_pool.acquire() as conn:
+            result = await conn.execute("""
+                DELETE FROM outbox
+                WHERE status = 'sent' AND sent_at < NOW() - make_interval(hours => $1)
+            """, OUTBOX_RETENTION_HOURS)
+        logger.info(f"🧹 Очистка outbox: {result}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка очистки outbox: {e}")
 
 
 # ========== Command Handlers ==========
 
-async def handle_list_tasks(user_id: int, chat_id: str):
-    """Обработчик команды /задачи - вывести список задач"""
+async def handle_list_tasks(user_id: int, chat_id: str, text: str = "/задачи"):
+    """Обработчик команды /задачи [дальше|назад] - вывести страницу списка задач"""
     try:
-        logger.info(f"📋 Пользователь {user_id} запросил список задач в чате {chat_id}")
-        
-        tasks = await get_user_tasks(user_id, chat_id)
-        response = format_task_list(tasks)
+        logger.info(f"📋 Пользователь {user_id} запросил список задач в чате {chat_id}: {text}")
+        
+        direction = text[len('/задачи'):].strip().lower()
+        cursor = None
+        if direction in ('дальше', 'назад'):
+            next_cursor, prev_cursor = task_list_cursors.get((user_id, chat_id), (None, None))
+            cursor = next_cursor if direction == 'дальше' else prev_cursor
+            if cursor is None:
+                await send_message(
+                    user_id,
+                    "⚠️ Страницы в этом направлении нет\n"
+                    "Используйте /задачи, чтобы начать список сначала"
+                )
+                return
+        
+        page = await get_user_tasks(user_id, chat_id, cursor)
+        task_list_cursors.set((user_id, chat_id), (page.next_cursor, page.prev_cursor))
+        response = format_task_list(page.items, page.next_cursor is not None, page.prev_cursor is not None)
         
         await send_message(user_id, response)
-        logger.info(f"✅ Отправлено {len(tasks)} задач пользователю {user_id}")
+        logger.info(f"✅ Отправлено {len(page.items)} задач пользователю {user_id}")
         
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка при обработке /задачи: {e}")
         await send_message(user_id, "⚠️ Произошла ошибка при получении списка задач")
 
 
+async def handle_search_tasks(user_id: int, chat_id: str, text: str):
+    """Обработчик команды /найти {запрос} - поиск задач чата"""
+    try:
+        query = text[len('/найти'):].strip()
+        if not query:
+            await send_message(
+                user_id,
+                "⚠️ Укажите, что искать\n"
+                "Например: /найти отчет"
+            )
+            return
+
+        logger.info(f"🔍 Пользователь {user_id} ищет задачи в чате {chat_id}: {query}")
+
+        cursor = None
+        if query.lower() == 'дальше':
+            previous = task_search_cursors.get((user_id, chat_id))
+            if previous and previous[1]:
+                query, cursor = previous
+
+        page = await search_tasks(chat_id, query, cursor)
+        task_search_cursors.set((user_id, chat_id), (query, page.next_cursor))
+
+        await send_message(user_id, format_search_results(query, page))
+        logger.info(f"✅ Найдено {len(page.items)} задач ({page.mode}) для пользователя {user_id}")
+
+    except RETRYABLE_ERRORS:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка при обработке /найти: {e}")
+        await send_message(user_id, "⚠️ Произошла ошибка при поиске задач")
+
+
 async def handle_complete_task(user_id: int, chat_id: str, text: str):
-    """Обработчик команды /готово {id} - отметить задачу выполненной"""
+    """Обработчик команды /готово {id ...} - отметить задачи выполненными"""
     try:
-        # Извлекаем ID задачи
-        match = re.search(r'/готово\s+(\d+)', text)
-        if not match:
+        # Извлекаем ID задач: "/готово 5", "/готово 3 5 8", "/готово 3-7"
+        task_ids = parse_task_ids(text[len('/готово'):])
+        if not task_ids:
             await send_message(
                 user_id,
                 "⚠️ Неверный формат команды\n"
                 "Используйте: /готово {id задачи}\n"
-                "Например: /готово 5"
+                "Например: /готово 5, /готово 3 5 8 или /готово 3-7"
             )
             return
         
-        task_id = int(match.group(1))
-        logger.info(f"✓ Пользователь {user_id} пытается завершить задачу {task_id}")
-        
-        # Отмечаем задачу как выполненную
-        success = await mark_task_completed(task_id, user_id)
-        
-        if success:
-            await send_message(user_id, f"✅ Задача #{task_id} отмечена как выполненная!")
-            logger.info(f"✅ Задача {task_id} завершена пользователем {user_id}")
-        else:
+        if len(task_ids) > BULK_TASK_LIMIT:
             await send_message(
                 user_id,
-                f"⚠️ Задача #{task_id} не найдена или уже выполнена\n"
-                f"Используйте /задачи для просмотра активных задач"
+                f"⚠️ За один раз можно отметить не больше {BULK_TASK_LIMIT} задач"
             )
-            logger.warning(f"⚠️ Задача {task_id} не найдена для пользователя {user_id}")
+            return
+        
+        logger.info(f"✓ Пользователь {user_id} пытается завершить задачи {task_ids}")
+        
+        # Отмечаем задачи одним запросом, подтверждение пишем в outbox той же транзакцией
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                completed = set(await repo.complete_user_tasks(task_ids, user_id, conn))
+                if completed:
+                    await add_outbox_message(conn, user_id, format_completion_report(task_ids, completed))
+        
+        if completed:
+            notify_outbox()
+            logger.info(f"✅ Задачи {sorted(completed)} завершены пользователем {user_id}")
+        else:
+            await send_message(user_id, format_completion_report(task_ids, completed))
+            logger.warning(f"⚠️ Задачи {task_ids} не найдены для пользователя {user_id}")
             
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка при обработке /готово: {e}")
         await send_message(user_id, "⚠️ Произошла ошибка при обновлении задачи")
@@ -551,19 +1651,30 @@ async def handle_create_task(user_id: int, chat_id: str, text: str):
         
         logger.info(f"➕ Пользователь {user_id} создает задачу: {title}")
         
-        # Создаем задачу
-        task_id = await create_task(user_id, chat_id, title, description)
+        # id чата получаем до захвата соединения: при промахе кэша это еще
+        # один запрос, и держать ради него занятое соединение нельзя
+        # (воркеров больше, чем соединений в пуле)
+        await get_or_create_chat(chat_id)
         
-        response = f"✅ Задача #{task_id} создана!\n\n"
-        response += f"📝 {title}"
-        if description:
-            response += f"\n📄 {description[:100]}"
-            if len(description) > 100:
-                response += "..."
+        # Создаем задачу и пишем подтверждение в outbox в одной транзакции
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                task_id = await create_task(user_id, chat_id, title, description, conn)
+                
+                response = f"✅ Задача #{task_id} создана!\n\n"
+                response += f"📝 {title}"
+                if description:
+                    response += f"\n📄 {description[:100]}"
+                    if len(description) > 100:
+                        response += "..."
+                
+                await add_outbox_message(conn, user_id, response)
         
-        await send_message(user_id, response)
+        notify_outbox()
         logger.info(f"✅ Создана задача {task_id} пользователем {user_id}")
         
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка при создании задачи: {e}")
         await send_message(user_id, "⚠️ Произошла ошибка при создании задачи")
@@ -624,6 +1735,8 @@ async def handle_onboarding_message(user_id: int, text: str, user: dict):
                 "✅ Отлично! Вечерний ритуал настроен.\n\n"
                 "🎉 Настройка завершена!\n\n"
                 "Я буду спрашивать о твоем самочувствии в указанное время.\n"
+                f"Часовой пояс: {user.get('timezone') or ritual_schedule.DEFAULT_TIMEZONE} "
+                "(изменить: /пояс Europe/Moscow)\n"
                 "Используй /помощь чтобы узнать о доступных командах."
             )
         else:
@@ -653,6 +1766,8 @@ async def validate_and_save_time(user_id: int, time_str: str, ritual_type: str)
         await update_user_ritual_time(user_id, ritual_type, time_str)
         logger.info(f"✅ Время {ritual_type} сохранено: {time_str}")
         return True
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения времени: {e}")
         import traceback
@@ -671,7 +1786,8 @@ async def handle_mood_response(user_id: int, text: str):
             ritual_type = "morning"  # по умолчанию
             
             if user:
-                current_time = datetime.now().time()
+                # Время ритуалов - местное для пользователя
+                current_time = ritual_schedule.local_now(user).time()
                 morning_time = user.get('morning_ritual_time')
                 evening_time = user.get('evening_ritual_time')
                 
@@ -691,7 +1807,8 @@ async def handle_mood_response(user_id: int, text: str):
                 elif evening_time:
                     ritual_type = "evening"
             
-            await log_mood(user_id, mood_level, ritual_type)
+            # Запись уходит в буфер, ответ пользователю не ждет БД
+            log_mood(user_id, mood_level, ritual_type)
             
             # Получаем описание из конфига
             mood_name = ritual_config.get_mood_description(mood_level)
@@ -719,6 +1836,59 @@ async def handle_mood_response(user_id: int, text: str):
         return False
 
 
+async def handle_set_timezone(user_id: int, text: str):
+    """Обработчик команды /пояс {зона} - часовой пояс для времени ритуалов"""
+    try:
+        zone_name = text[len('/пояс'):].strip()
+        
+        if not zone_name:
+            user = await get_user(user_id)
+            current = (user or {}).get('timezone') or ritual_schedule.DEFAULT_TIMEZONE
+            await send_message(
+                user_id,
+                f"🕐 Ваш часовой пояс: {current}\n"
+                "Изменить: /пояс Europe/Moscow"
+            )
+            return
+        
+        zone = ritual_schedule.get_zone(zone_name)
+        if zone is None:
+            await send_message(
+                user_id,
+                f"⚠️ Неизвестный часовой пояс: {zone_name}\n"
+                "Укажите пояс в формате Регион/Город, например: /пояс Asia/Yekaterinburg"
+            )
+            return
+        
+        await update_user_timezone(user_id, zone.key)
+        local_time = datetime.now(zone).strftime("%H:%M")
+        await send_message(
+            user_id,
+            f"✅ Часовой пояс изменен: {zone.key} (сейчас {local_time})\n"
+            "Ритуалы будут приходить по этому времени"
+        )
+        logger.info(f"🕐 Пользователь {user_id} сменил часовой пояс на {zone.key}")
+        
+    except RETRYABLE_ERRORS:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка при обработке /пояс: {e}")
+        await send_message(user_id, "⚠️ Произошла ошибка при смене часового пояса")
+
+
+async def handle_mood_stats(user_id: int):
+    """Обработчик команды /настроение - статистика самочувствия"""
+    try:
+        stats = await repo.get_mood_stats(user_id)
+        await send_message(user_id, format_mood_stats(stats))
+        logger.info(f"✅ Отправлена статистика самочувствия пользователю {user_id}")
+    except RETRYABLE_ERRORS:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка при обработке /настроение: {e}")
+        await send_message(user_id, "⚠️ Произошла ошибка при получении статистики")
+
+
 async def handle_help(user_id: int):
     """Обработчик команды /помощь - показать справку"""
     help_text = """
@@ -726,10 +1896,12 @@ async def handle_help(user_id: int):
 
 📋 /задачи
    Показать список ваших активных задач
+   Длинный список листается: /задачи дальше, /задачи назад
 
 ✅ /готово {id}
    Отметить задачу как выполненную
    Например: /готово 5
+   Несколько задач сразу: /готово 3 5 8 или /готово 3-7
 
 ➕ /создать {название}
    Создать новую задачу
@@ -739,6 +1911,18 @@ async def handle_help(user_id: int):
    /создать Написать отчет
    Подготовить квартальный отчет по проекту
 
+🔍 /найти {запрос}
+   Найти задачи по названию, описанию и тегу
+   Например: /найти отчет
+   Следующие результаты: /найти дальше
+
+📊 /настроение
+   Статистика самочувствия за неделю и месяц
+
+🕐 /пояс {зона}
+   Часовой пояс для времени ритуалов
+   Например: /пояс Europe/Moscow
+
 🔄 /start
    Перезапустить настройку ритуалов
 
@@ -783,7 +1967,7 @@ async def send_ritual_to_user(user_id: int, ritual_type: str):
         success = await send_message_with_image(user_id, full_text, image_path)
         
         if success:
-            logger.info(f"✅ Ритуал {ritual_type} отправлен пользователю {user_id}")
+            logger.info(f"✅ Ритуал {ritual_type} поставлен в очередь для пользователя {user_id}")
         else:
             logger.error(f"❌ Не удалось отправить ритуал {ritual_type} пользователю {user_id}")
             
@@ -793,46 +1977,214 @@ async def send_ritual_to_user(user_id: int, ritual_type: str):
         traceback.print_exc()
 
 
-async def check_and_send_rituals():
+async def advance_rituals(conn: asyncpg.Connection, schedule: List[tuple]) -> Set[int]:
+    """
+    Записать следующий ритуал пользователям одним запросом
+
+    Args:
+        schedule: кортежи (max_user_id, прежний next_ritual_at, новый next_ritual_at, новый тип).
+            Строка обновляется, только если next_ritual_at не изменился с момента
+            выборки (пользователь мог поменять настройки, или ритуал уже сдвинул
+            другой планировщик).
+    
+    Returns:
+        ID пользователей, чьи строки обновлены
     """
-    Проверить время и отправить ритуалы всем пользователям
-    Эта функция вызывается планировщиком каждую минуту
+    if not schedule:
+        return set()
+    
+    user_ids, previous, next_at, next_type = zip(*schedule)
+    rows = await conn.fetch("""
+        UPDATE users u
+        SET next_ritual_at = s.next_at, next_ritual_type = s.next_type
+        FROM unnest($1::bigint[], $2::timestamptz[], $3::timestamptz[], $4::text[])
+            AS s(user_id, previous_at, next_at, next_type)
+        WHERE u.max_user_id = s.user_id
+          AND u.next_ritual_at IS NOT DISTINCT FROM s.previous_at
+        RETURNING u.max_user_id
+    """, list(user_ids), list(previous), list(next_at), list(next_type))
+    return {row['max_user_id'] for row in rows}
+
+
+async def schedule_unscheduled_rituals():
     """
-    try:
-        current_time = datetime.now().time()
-        current_hour = current_time.hour
-        current_minute = current_time.minute
-        
-        logger.info(f"🕐 Проверка ритуалов: {current_hour:02d}:{current_minute:02d}")
-        
-        # Получаем всех пользователей с настроенными ритуалами
+    Рассчитать ближайший ритуал пользователям, у которых он еще не рассчитан
+
+    Нужно после миграции: дальше next_ritual_at обновляется при изменении
+    настроек и после каждой отправки.
+    """
+    now = datetime.now(timezone.utc)
+    async with db_pool.acquire() as conn:
+        users = await conn.fetch("""
+            SELECT * FROM users
+            WHERE next_ritual_at IS NULL
+              AND onboarding_step = 'completed'
+              AND (morning_ritual_time IS NOT NULL OR evening_ritual_time IS NOT NULL)
+        """)
+        
+        schedule = []
+        for user in users:
+            scheduled = ritual_schedule.next_ritual(dict(user), now)
+            if scheduled is None:
+                continue
+            next_at, next_type = scheduled
+            schedule.append((user['max_user_id'], None, next_at, next_type))
+        advanced = await advance_rituals(conn, schedule)
+    
+    if advanced:
+        logger.info(f"🗓️ Рассчитано время ритуалов для {len(advanced)} пользователей")
+
+
+async def fire_due_rituals(user_ids: List[int], now: datetime):
+    """
+    Отправить ритуалы пользователям из очереди, которым пора
+    
+    Состояние перечитывается из БД (источник истины - next_ritual_at):
+    пользователь мог изменить настройки, или ритуал уже отправлен.
+    Читаются только строки этих пользователей.
+    """
+    max_delay = timedelta(minutes=RITUAL_MAX_DELAY_MINUTES)
+    
+    for offset in range(0, len(user_ids), RITUAL_BATCH_SIZE):
         async with db_pool.acquire() as conn:
             users = await conn.fetch("""
-                SELECT max_user_id, morning_ritual_time, evening_ritual_time 
-                FROM users 
-                WHERE onboarding_step = 'completed'
-                  AND (morning_ritual_time IS NOT NULL OR evening_ritual_time IS NOT NULL)
-            """)
-        
-        for user in users:
-            user_id = user['max_user_id']
-            morning_time = user['morning_ritual_time']
-            evening_time = user['evening_ritual_time']
-            
-            # Проверяем утренний ритуал
-            if morning_time and morning_time.hour == current_hour and morning_time.minute == current_minute:
-                logger.info(f"🌅 Время утреннего ритуала для пользователя {user_id}")
-                await send_ritual_to_user(user_id, "morning")
+                SELECT max_user_id, onboarding_step, morning_ritual_time, evening_ritual_time,
+                       timezone, next_ritual_at, next_ritual_type
+                FROM users
+                WHERE max_user_id = ANY($1::bigint[]) AND next_ritual_at <= $2
+            """, user_ids[offset:offset + RITUAL_BATCH_SIZE], now)
             
-            # Проверяем вечерний ритуал
-            if evening_time and evening_time.hour == current_hour and evening_time.minute == current_minute:
-                logger.info(f"🌙 Время вечернего ритуала для пользователя {user_id}")
-                await send_ritual_to_user(user_id, "evening")
+            due = []
+            schedule = []
+            for user in users:
+                fired_at = user['next_ritual_at']
+                if now - fired_at <= max_delay:
+                    due.append((user['max_user_id'], user['next_ritual_type']))
+                    after = fired_at
+                else:
+                    # Ритуал пропущен (бот был остановлен) - планируем следующий от текущего момента
+                    logger.warning(f"⚠️ Пропущен ритуал пользователя {user['max_user_id']} на {fired_at}")
+                    after = now
                 
+                scheduled = ritual_schedule.next_ritual(dict(user), after)
+                next_at, next_type = scheduled or (None, None)
+                schedule.append((user['max_user_id'], fired_at, next_at, next_type))
+            
+            # Сначала сдвигаем расписание и отправляем только сдвинутым: строку,
+            # которую уже сдвинул другой планировщик, UPDATE не затронет
+            advanced = await advance_rituals(conn, schedule)
+        
+        for user_id, _, next_at, _ in schedule:
+            if user_id in advanced:
+                queue_user_ritual(user_id, next_at)
+        
+        for user_id, ritual_type in due:
+            if user_id not in advanced:
+                continue
+            logger.info(f"{'🌅' if ritual_type == 'morning' else '🌙'} Время ритуала {ritual_type} для пользователя {user_id}")
+            await send_ritual_to_user(user_id, ritual_type)
+
+
+def queue_user_ritual(user_id: int, next_at: Optional[datetime]):
+    """Обновить ритуал пользователя в очереди планировщика этого экземпляра"""
+    if ritual_engine is None or ritual_queue_until is None:
+        return
+    
+    # Ритуалы дальше горизонта попадут в очередь при ее следующей загрузке
+    if next_at is not None and next_at >= ritual_queue_until:
+        next_at = None
+    ritual_queue.schedule(user_id, next_at)
+    ritual_wakeup.set()
+
+
+async def refresh_user_ritual(user_id: int):
+    """Перечитать ближайший ритуал пользователя, измененный другим экземпляром"""
+    try:
+        async with db_pool.acquire() as conn:
+            next_at = await conn.fetchval(
+                "SELECT next_ritual_at FROM users WHERE max_user_id = $1",
+                user_id
+            )
+        queue_user_ritual(user_id, next_at)
     except Exception as e:
-        logger.error(f"❌ Ошибка при проверке ритуалов: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.warning(f"⚠️ Не удалось обновить ритуал пользователя {user_id} в очереди: {e}")
+
+
+async def load_ritual_queue(now: datetime):
+    """Загрузить в очередь ритуалы до горизонта (и просроченные) по индексу next_ritual_at"""
+    global ritual_queue_until
+    
+    until = now + timedelta(minutes=RITUAL_QUEUE_HORIZON_MINUTES)
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT max_user_id, next_ritual_at FROM users WHERE next_ritual_at < $1",
+            until
+        )
+    
+    ritual_queue.clear()
+    for row in rows:
+        ritual_queue.schedule(row['max_user_id'], row['next_ritual_at'])
+    ritual_queue_until = until
+    logger.info(f"🗓️ В очереди ритуалов до {until:%H:%M} UTC: {len(ritual_queue)}")
+
+
+async def run_ritual_engine():
+    """
+    Цикл отправки ритуалов
+    
+    Спит до ближайшего ритуала в очереди (или до горизонта ее загрузки);
+    изменение настроек пользователя будит цикл, чтобы пересчитать сон.
+    """
+    try:
+        await schedule_unscheduled_rituals()
+    except Exception as e:
+        logger.error(f"❌ Ошибка расчета времени ритуалов: {e}")
+    
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            if ritual_queue_until is None or now >= ritual_queue_until:
+                await load_ritual_queue(now)
+            
+            due = ritual_queue.pop_due(now)
+            if due:
+                await fire_due_rituals(due, now)
+            
+            wake_at = ritual_queue.next_fire_time() or ritual_queue_until
+            wake_at = min(wake_at, ritual_queue_until)
+            delay = (wake_at - datetime.now(timezone.utc)).total_seconds()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка при отправке ритуалов: {e}")
+            import traceback
+            traceback.print_exc()
+            delay = RITUAL_RETRY_INTERVAL
+        
+        ritual_wakeup.clear()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(ritual_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def start_ritual_engine():
+    """Запустить цикл отправки ритуалов"""
+    global ritual_engine
+    if ritual_engine is None:
+        ritual_engine = asyncio.create_task(run_ritual_engine())
+
+
+async def stop_ritual_engine():
+    """Остановить цикл отправки ритуалов"""
+    global ritual_engine, ritual_queue_until
+    if ritual_engine:
+        ritual_engine.cancel()
+        await asyncio.gather(ritual_engine, return_exceptions=True)
+        ritual_engine = None
+        ritual_queue_until = None
+        ritual_queue.clear()
 
 
 async def init_scheduler():
@@ -842,17 +2194,40 @@ async def init_scheduler():
     try:
         scheduler = AsyncIOScheduler()
         
-        # Добавляем задачу проверки ритуалов каждую минуту
+        # Ритуалы отправляет свой цикл: он спит до ближайшего ритуала
+        await start_ritual_engine()
+        
+        # Очистка журнала обработанных обновлений раз в час
+        scheduler.add_job(
+            prune_processed_updates,
+            CronTrigger(minute=30),
+            id='update_ledger_pruner',
+            name='Очистка журнала обновлений',
+            replace_existing=True
+        )
+        
+        # Очистка отправленных сообщений outbox раз в час
+        scheduler.add_job(
+            prune_outbox,
+            CronTrigger(minute=40),
+            id='outbox_pruner',
+            name='Очистка outbox',
+            replace_existing=True
+        )
+        
+        # Секции mood_logs, их свертка и архивация задач раз в сутки
+        # (и сразу при запуске, чтобы секция текущего месяца точно была)
         scheduler.add_job(
-            check_and_send_rituals,
-            CronTrigger(second=0),  # Запускать в начале каждой минуты
-            id='ritual_checker',
-            name='Проверка и отправка ритуалов',
+            run_storage_retention,
+            CronTrigger(hour=3, minute=20),
+            id='storage_retention',
+            name='Хранение mood_logs и архив задач',
+            next_run_time=datetime.now(),
             replace_existing=True
         )
         
         scheduler.start()
-        logger.info("✅ Планировщик ритуалов запущен (проверка каждую минуту)")
+        logger.info("✅ Планировщик ритуалов запущен")
         
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации планировщика: {e}")
@@ -863,11 +2238,135 @@ async def init_scheduler():
 async def shutdown_scheduler():
     """Остановка планировщика"""
     global scheduler
+    await stop_ritual_engine()
     if scheduler:
         scheduler.shutdown()
+        scheduler = None
         logger.info("❌ Планировщик ритуалов остановлен")
 
 
+# ========== Update Dispatcher ==========
+
+def get_update_key(update: Dict[str, Any]) -> str:
+    """
+    Ключ упорядочивания обновления
+
+    Обновления одного пользователя (или чата, если отправитель неизвестен)
+    обрабатываются строго последовательно, разных - параллельно.
+    """
+    update_type = update.get("update_type")
+
+    if update_type == "message_created":
+        message = update.get("message", {})
+        user_id = message.get("sender", {}).get("user_id") or message.get("from", {}).get("user_id")
+        if user_id:
+            return f"user:{user_id}"
+        chat_id = message.get("recipient", {}).get("chat_id")
+        if chat_id:
+            return f"chat:{chat_id}"
+
+    user_id = update.get("user_id") or update.get("user", {}).get("user_id")
+    if user_id:
+        return f"user:{user_id}"
+
+    chat_id = update.get("chat_id")
+    if chat_id:
+        return f"chat:{chat_id}"
+
+    return f"type:{update_type}"
+
+
+def get_update_id(update: Dict[str, Any]) -> Optional[str]:
+    """
+    Идемпотентный ключ обновления
+
+    Для сообщений используется mid, для остальных событий - комбинация
+    типа, времени и участника.
+    """
+    update_type = update.get("update_type")
+    
+    if update_type == "message_created":
+        mid = update.get("message", {}).get("body", {}).get("mid")
+        if mid:
+            return f"mid:{mid}"
+    
+    timestamp = update.get("timestamp")
+    if not timestamp:
+        return None
+    
+    participant = (
+        update.get("user_id")
+        or update.get("user", {}).get("user_id")
+        or update.get("chat_id")
+    )
+    return f"{update_type}:{timestamp}:{participant}"
+
+
+async def handle_update(update: Dict[str, Any]) -> bool:
+    """
+    Обработать обновление, пропустив уже обработанные ранее
+
+    Обновление отмечается обработанным только после process_update: если
+    обработка прервана остановкой или сбоем инфраструктуры (RETRYABLE_ERRORS,
+    обработчики их не перехватывают), захват снимается и повторная доставка
+    его обработает. Прочие ошибки обработчики сообщают пользователю, и
+    обновление считается обработанным.
+
+    Returns:
+        True, если обновление обработано, False - если пропущено как повтор
+    """
+    update_id = get_update_id(update)
+    
+    if update_id and not await claim_update(update_id):
+        logger.info(f"⏭️ Обновление {update_id} уже обработано, пропускаем")
+        return False
+    
+    try:
+        await process_update(update)
+    except BaseException:
+        if update_id:
+            try:
+                await release_update(update_id)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось снять захват обновления {update_id}: {e}")
+        raise
+    
+    if update_id:
+        await complete_update(update_id)
+    return True
+
+
+async def init_dispatcher():
+    """Инициализация диспетчера обновлений"""
+    global update_dispatcher
+    update_dispatcher = KeyedDispatcher(handle_update, UPDATE_WORKERS, name="updates")
+    logger.info(f"✅ Диспетчер обновлений запущен (воркеров: {UPDATE_WORKERS})")
+
+
+async def close_dispatcher():
+    """Остановка диспетчера обновлений"""
+    global update_dispatcher
+    if update_dispatcher:
+        await update_dispatcher.close()
+        logger.info("❌ Диспетчер обновлений остановлен")
+
+
+async def dispatch_updates(updates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Обработать пачку обновлений параллельно с сохранением порядка по пользователю
+
+    Returns:
+        Обновления, обработка которых завершилась ошибкой
+    """
+    results = await update_dispatcher.dispatch(
+        (get_update_key(update), update) for update in updates
+    )
+    return [
+        update for update, result in zip(updates, results)
+        if isinstance(result, BaseException)
+    ]
+
+
 # ========== Long Polling ==========
 
 async def get_updates(offset: int = 0, timeout: int = 60):
@@ -897,6 +2396,8 @@ async def get_updates(offset: int = 0, timeout: int = 60):
         else:
             logger.error(f"❌ Ошибка получения обновлений: {response.status_code}")
             logger.error(f"Ответ: {response.text}")
+            # Пауза, чтобы не долбить API при ошибках
+            await asyncio.sleep(POLL_ERROR_DELAY)
             return [], offset
             
     except httpx.TimeoutException:
@@ -904,6 +2405,7 @@ async def get_updates(offset: int = 0, timeout: int = 60):
         return [], offset
     except Exception as e:
         logger.error(f"❌ Ошибка при получении обновлений: {e}")
+        await asyncio.sleep(POLL_ERROR_DELAY)
         return [], offset
 
 
@@ -943,12 +2445,18 @@ async def process_message(message: Dict[str, Any]):
             return
         
         # Маршрутизация команд
-        if text == '/задачи':
-            await handle_list_tasks(user_id, chat_id)
+        if text == '/задачи' or text.startswith('/задачи '):
+            await handle_list_tasks(user_id, chat_id, text)
         elif text.startswith('/готово'):
             await handle_complete_task(user_id, chat_id, text)
         elif text.startswith('/создать'):
             await handle_create_task(user_id, chat_id, text)
+        elif text == '/найти' or text.startswith('/найти '):
+            await handle_search_tasks(user_id, chat_id, text)
+        elif text == '/настроение':
+            await handle_mood_stats(user_id)
+        elif text == '/пояс' or text.startswith('/пояс '):
+            await handle_set_timezone(user_id, text)
         elif text == '/помощь' or text == '/help':
             await handle_help(user_id)
         elif text.startswith('/'):
@@ -964,6 +2472,8 @@ async def process_message(message: Dict[str, Any]):
                     pass
             # Игнорируем остальные обычные сообщения
         
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка при обработке сообщения: {e}")
         import traceback
@@ -997,46 +2507,356 @@ async def process_update(update: Dict[str, Any]):
         else:
             logger.warning(f"⚠️ Неизвестный тип обновления: {update_type}")
         
+    except RETRYABLE_ERRORS:
+        raise
     except Exception as e:
         logger.error(f"❌ Ошибка при обработке обновления: {e}")
         import traceback
         traceback.print_exc()
 
 
-async def long_polling_loop():
-    """Основной цикл long polling"""
-    
+async def poll_updates(batches: asyncio.Queue, marker: int = 0):
+    """
+    Поллер: непрерывно запрашивает обновления и складывает пачки в очередь
+
+    Следующий запрос уходит сразу после получения ответа, не дожидаясь
+    обработки предыдущей пачки. Если очередь заполнена, поллер ждет
+    освобождения места (backpressure).
+    """
     logger.info("📡 Запуск long polling...")
     
-    # MAX API использует marker для отслеживания позиции
-    last_marker = 0
-    
     while True:
         try:
             # Получаем обновления и новый marker
-            updates, new_marker = await get_updates(offset=last_marker, timeout=60)
-            
-            # Обновляем marker
-            last_marker = new_marker
+            updates, marker = await get_updates(offset=marker, timeout=POLL_TIMEOUT)
             
             if updates:
                 logger.info(f"📬 Получено {len(updates)} обновлений")
+                await batches.put((updates, marker))
                 
-                for update in updates:
-                    # Обрабатываем обновление
-                    await process_update(update)
-            
-            # Небольшая задержка между запросами (если не было обновлений)
-            if not updates:
-                await asyncio.sleep(1)
-                
-        except KeyboardInterrupt:
-            logger.info("⏹️  Получен сигнал остановки")
-            break
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"❌ Ошибка в long polling: {e}")
             # Ждем перед повторной попыткой
-            await asyncio.sleep(5)
+            await asyncio.sleep(POLL_ERROR_DELAY)
+
+
+async def process_batches(batches: asyncio.Queue):
+    """
+    Обработчик: забирает пачки из очереди и передает их диспетчеру
+
+    Поллер уже запросил обновления дальше этой пачки, поэтому пачка не
+    отбрасывается при ошибке: необработанные обновления повторяются, пока
+    пачка не будет обработана и ее marker сохранен. Пока идут повторы,
+    очередь пачек заполняется и поллер останавливается (backpressure).
+    Уже обработанные обновления при повторе пропускает журнал.
+    """
+    while True:
+        updates, marker = await batches.get()
+        try:
+            while True:
+                try:
+                    # Обрабатываем пачку параллельно по пользователям
+                    updates = await dispatch_updates(updates)
+                    if not updates:
+                        # Пачка обработана - фиксируем marker, чтобы не потерять позицию при рестарте
+                        await save_marker(marker)
+                        break
+                    logger.error(f"❌ Не обработано обновлений из пачки: {len(updates)}, повторяем")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ Ошибка при обработке пачки обновлений: {e}")
+                await asyncio.sleep(POLL_ERROR_DELAY)
+        finally:
+            batches.task_done()
+
+
+async def long_polling_loop():
+    """Основной цикл long polling: поллер и обработчик работают конвейером"""
+    
+    # Ограниченная очередь между поллером и обработкой пачек
+    batches: asyncio.Queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+    
+    # MAX API использует marker для отслеживания позиции,
+    # продолжаем с последнего сохраненного
+    marker = await load_marker()
+    logger.info(f"📍 Продолжаем с marker={marker}")
+    
+    poller = asyncio.create_task(poll_updates(batches, marker=marker))
+    consumer = asyncio.create_task(process_batches(batches))
+    
+    try:
+        await asyncio.gather(poller, consumer)
+    finally:
+        poller.cancel()
+        consumer.cancel()
+        await asyncio.gather(poller, consumer, return_exceptions=True)
+
+
+# ========== Webhook Ingress ==========
+
+def enqueue_updates(updates: List[Dict[str, Any]]) -> bool:
+    """
+    Принять пачку обновлений из webhook во внутреннюю очередь целиком
+
+    Место проверяется сразу для всей пачки: иначе часть пачки попала бы в
+    очередь до отказа, и повторная доставка обработала бы ее второй раз.
+
+    Returns:
+        False, если для пачки нет места (MAX повторит доставку позже)
+    """
+    if webhook_queue.maxsize - webhook_queue.qsize() < len(updates):
+        logger.warning(f"⚠️ Очередь webhook переполнена, пачка из {len(updates)} обновлений отклонена")
+        return False
+    
+    for update in updates:
+        webhook_queue.put_nowait(update)
+    return True
+
+
+async def consume_webhook_updates():
+    """Передавать обновления из webhook очереди диспетчеру"""
+    # Ограничиваем число обновлений, уже переданных диспетчеру, чтобы
+    # переполнение проявлялось на входе (503), а не росло в памяти
+    in_flight = asyncio.Semaphore(WEBHOOK_QUEUE_SIZE)
+    
+    while True:
+        update = await webhook_queue.get()
+        try:
+            await in_flight.acquire()
+            done = update_dispatcher.submit(get_update_key(update), update)
+            done.add_done_callback(lambda future, update=update: on_webhook_update_done(future, update, in_flight))
+        finally:
+            webhook_queue.task_done()
+
+
+def on_webhook_update_done(future: asyncio.Future, update: Dict[str, Any], in_flight: asyncio.Semaphore):
+    """Освободить место и повторить обновление, обработка которого прервана сбоем"""
+    in_flight.release()
+    if future.cancelled() or future.exception() is None:
+        return
+    
+    # MAX уже получил подтверждение и повторно не доставит: повторяем сами
+    task = asyncio.create_task(retry_webhook_update(update))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def retry_webhook_update(update: Dict[str, Any]):
+    """Вернуть обновление в webhook очередь после паузы"""
+    await asyncio.sleep(POLL_ERROR_DELAY)
+    await webhook_queue.put(update)
+
+
+async def subscribe_webhook(url: str, secret: str = "") -> bool:
+    """Подписать бота на доставку обновлений по webhook"""
+    payload = {"url": url}
+    if secret:
+        payload["secret"] = secret
+    
+    try:
+        response = await http_client.post(f"{BASE_URL}/subscriptions", json=payload)
+        if response.status_code == 200:
+            logger.info(f"✅ Webhook подписка оформлена: {url}")
+            return True
+        logger.error(f"❌ Ошибка подписки на webhook: {response.status_code} - {response.text}")
+        return False
+    except Exception as e:
+        logger.error(f"❌ Ошибка при подписке на webhook: {e}")
+        return False
+
+
+async def start_webhook_ingress(run_scheduler: bool = True):
+    """
+    Запустить обработку обновлений, поступающих через webhook
+
+    Инициализирует те же ресурсы, что и main(), но вместо long polling
+    обновления приходят через enqueue_updates().
+    """
+    global webhook_queue, webhook_consumer, webhook_leader
+    
+    await init_db_pool()
+    await init_http_client()
+    await init_upload_client()
+    await preload_ritual_images()
+    await init_outbound_queue()
+    await init_outbox_dispatcher()
+    await init_mood_writer()
+    await init_user_cache_listener()
+    await init_dispatcher()
+    if CLUSTER_MODE or run_scheduler:
+        # Воркеров uvicorn за балансировщиком может быть несколько: планировщик
+        # получит только выигравший выборы лидера (advisory lock в Postgres)
+        webhook_leader = asyncio.create_task(leader_election_loop(poll=False))
+    
+    webhook_queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+    webhook_consumer = asyncio.create_task(consume_webhook_updates())
+    logger.info("✅ Приём обновлений через webhook запущен")
+
+
+async def stop_webhook_ingress():
+    """Остановить обработку webhook обновлений и освободить ресурсы"""
+    global webhook_consumer, webhook_leader
+    
+    if webhook_leader:
+        webhook_leader.cancel()
+        await asyncio.gather(webhook_leader, return_exceptions=True)
+        webhook_leader = None
+    
+    if webhook_consumer:
+        # Даем дообработать уже принятые обновления
+        await webhook_queue.join()
+        webhook_consumer.cancel()
+        await asyncio.gather(webhook_consumer, return_exceptions=True)
+        webhook_consumer = None
+    
+    if update_dispatcher:
+        await update_dispatcher.join()
+    
+    await shutdown_scheduler()
+    await close_dispatcher()
+    await close_user_cache_listener()
+    await close_outbox_dispatcher()
+    await close_mood_writer()
+    await close_outbound_queue()
+    await close_upload_client()
+    await close_http_client()
+    await close_db_pool()
+    logger.info("❌ Приём обновлений через webhook остановлен")
+
+
+# ========== Cluster Mode ==========
+
+async def enqueue_batches(batches: asyncio.Queue):
+    """Лидер: переносить полученные пачки обновлений в общую очередь в БД"""
+    while True:
+        updates, marker = await batches.get()
+        try:
+            # Повторяем, пока пачка не записана: поллер уже ушел дальше нее
+            while True:
+                try:
+                    await enqueue_updates_to_table(updates, marker)
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"❌ Ошибка записи обновлений в очередь: {e}")
+                await asyncio.sleep(POLL_ERROR_DELAY)
+        finally:
+            batches.task_done()
+
+
+async def consume_update_queue():
+    """Все экземпляры: разбирать общую очередь обновлений из БД"""
+    logger.info(f"📥 Разбор очереди обновлений запущен ({INSTANCE_ID})")
+    
+    while True:
+        try:
+            rows = await claim_queued_updates(QUEUE_BATCH_SIZE)
+            
+            if not rows:
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+                continue
+            
+            results = await update_dispatcher.dispatch(
+                (row['order_key'], json.loads(row['payload'])) for row in rows
+            )
+            
+            done = []
+            for row, result in zip(rows, results):
+                if isinstance(result, BaseException):
+                    # Остается в очереди: после истечения аренды будет выдано снова
+                    logger.error(f"❌ Обновление {row['id']} из очереди не обработано: {result}")
+                    continue
+                if row['attempts'] > 1:
+                    outcome = "обработано" if result else "уже было обработано до сбоя"
+                    logger.warning(f"⚠️ Повторная выдача обновления {row['id']} (попытка {row['attempts']}): {outcome}")
+                done.append(row['id'])
+            
+            if done:
+                await delete_queued_updates(done)
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка разбора очереди обновлений: {e}")
+            await asyncio.sleep(POLL_ERROR_DELAY)
+
+
+async def run_as_leader(lock_conn: asyncpg.Connection, poll: bool):
+    """Выполнять обязанности лидера, пока удерживается advisory lock"""
+    tasks = []
+    
+    if poll:
+        batches: asyncio.Queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+        marker = await load_marker()
+        logger.info(f"📍 Лидер продолжает с marker={marker}")
+        tasks.append(asyncio.create_task(poll_updates(batches, marker=marker)))
+        tasks.append(asyncio.create_task(enqueue_batches(batches)))
+    
+    # Ритуалы рассылает только лидер
+    await init_scheduler()
+    
+    try:
+        while True:
+            await asyncio.sleep(LEADER_HEARTBEAT_INTERVAL)
+            for task in tasks:
+                if task.done():
+                    task.result()
+            # Если соединение с БД потеряно, блокировка уже снята - выходим
+            await lock_conn.fetchval("SELECT 1")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await shutdown_scheduler()
+
+
+async def leader_election_loop(poll: bool = True):
+    """
+    Выборы лидера через advisory lock в Postgres
+
+    Лидер опрашивает MAX API (если poll=True) и запускает планировщик ритуалов.
+    Блокировка держится на отдельном соединении и снимается автоматически,
+    если процесс упадет.
+    """
+    while True:
+        lock_conn = None
+        try:
+            lock_conn = await asyncpg.connect(DATABASE_URL)
+            acquired = await lock_conn.fetchval(
+                "SELECT pg_try_advisory_lock($1)",
+                LEADER_LOCK_ID
+            )
+            
+            if acquired:
+                logger.info(f"👑 Экземпляр {INSTANCE_ID} стал лидером")
+                await run_as_leader(lock_conn, poll)
+                
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Лидерство потеряно или недоступно: {e}")
+        finally:
+            if lock_conn:
+                await asyncio.gather(lock_conn.close(), return_exceptions=True)
+        
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+
+
+async def cluster_loop():
+    """Основной цикл в режиме нескольких экземпляров"""
+    leader = asyncio.create_task(leader_election_loop(poll=True))
+    consumer = asyncio.create_task(consume_update_queue())
+    
+    try:
+        await asyncio.gather(leader, consumer)
+    finally:
+        leader.cancel()
+        consumer.cancel()
+        await asyncio.gather(leader, consumer, return_exceptions=True)
 
 
 # ========== Main ==========
@@ -1049,10 +2869,22 @@ async def main():
         # Инициализация
         await init_db_pool()
         await init_http_client()
-        await init_scheduler()
-        
-        # Запускаем long polling
-        await long_polling_loop()
+        await init_upload_client()
+        await preload_ritual_images()
+        await init_outbound_queue()
+        await init_outbox_dispatcher()
+        await init_mood_writer()
+        await init_user_cache_listener()
+        await init_dispatcher()
+        
+        if CLUSTER_MODE:
+            # Поллинг и ритуалы - у лидера, обработка - у всех экземпляров
+            await cluster_loop()
+        else:
+            await release_update_claims()
+            await init_scheduler()
+            # Запускаем long polling
+            await long_polling_loop()
         
     except KeyboardInterrupt:
         logger.info("⏹️  Получен сигнал остановки")
@@ -1063,6 +2895,12 @@ async def main():
     finally:
         # Закрываем соединения
         await shutdown_scheduler()
+        await close_dispatcher()
+        await close_user_cache_listener()
+        await close_outbox_dispatcher()
+        await close_mood_writer()
+        await close_outbound_queue()
+        await close_upload_client()
         await close_http_client()
         await close_db_pool()
         logger.info("👋 Бот остановлен")
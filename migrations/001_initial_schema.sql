@@ -1,5 +1,5 @@
--- Полная инициализация БД для Tasker MAX Bot
--- Выполняется автоматически при первом запуске PostgreSQL контейнера
+-- Исходная схема БД для Tasker MAX Bot
+-- Применяется migrate.py при запуске бота (безопасно и для уже созданной БД)
 
 -- ========== Чаты ==========
 CREATE TABLE IF NOT EXISTS chats (
@@ -50,6 +50,50 @@ CREATE TABLE IF NOT EXISTS mood_logs (
   logged_at       TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- ========== Состояние бота ==========
+CREATE TABLE IF NOT EXISTS bot_state (
+  key             TEXT PRIMARY KEY,                -- Например, 'updates_marker'
+  value           TEXT NOT NULL,
+  updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- ========== Журнал обработанных обновлений ==========
+CREATE TABLE IF NOT EXISTS processed_updates (
+  update_id       TEXT PRIMARY KEY,                -- mid сообщения или ключ события
+  processed_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- ========== Очередь обновлений (режим нескольких экземпляров) ==========
+CREATE TABLE IF NOT EXISTS update_queue (
+  id              BIGSERIAL PRIMARY KEY,
+  order_key       TEXT NOT NULL,                   -- Ключ упорядочивания (пользователь/чат)
+  payload         JSONB NOT NULL,                  -- Обновление MAX API
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  locked_until    TIMESTAMPTZ,                     -- Аренда обработки экземпляром
+  locked_by       TEXT                             -- Экземпляр, взявший обновление
+);
+
+-- ========== Кэш загруженных изображений ==========
+CREATE TABLE IF NOT EXISTS upload_cache (
+  content_hash    TEXT PRIMARY KEY,                -- SHA-256 содержимого файла
+  payload         JSONB NOT NULL,                  -- Структура photos/token от MAX API
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  expires_at      TIMESTAMPTZ NOT NULL
+);
+
+-- ========== Outbox исходящих сообщений ==========
+CREATE TABLE IF NOT EXISTS outbox (
+  id              BIGSERIAL PRIMARY KEY,
+  user_id         BIGINT NOT NULL,                 -- Получатель (max_user_id)
+  payload         JSONB NOT NULL,                  -- Тело запроса POST /messages
+  status          VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending, sent, failed
+  attempts        INT NOT NULL DEFAULT 0,
+  last_error      TEXT,
+  created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  sent_at         TIMESTAMPTZ
+);
+
 -- ========== Индексы для производительности ==========
 CREATE INDEX IF NOT EXISTS idx_chats_max_chat_id ON chats(max_chat_id);
 CREATE INDEX IF NOT EXISTS idx_tasks_chat_id ON tasks(chat_id);
@@ -59,11 +103,20 @@ CREATE INDEX IF NOT EXISTS idx_tasks_reminder ON tasks(reminder_at);
 CREATE INDEX IF NOT EXISTS idx_users_max_user_id ON users(max_user_id);
 CREATE INDEX IF NOT EXISTS idx_mood_logs_user_id ON mood_logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_mood_logs_logged_at ON mood_logs(logged_at);
+CREATE INDEX IF NOT EXISTS idx_processed_updates_processed_at ON processed_updates(processed_at);
+CREATE INDEX IF NOT EXISTS idx_update_queue_order_key ON update_queue(order_key, id);
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_outbox_sent_at ON outbox(sent_at) WHERE status = 'sent';
 
 -- ========== Комментарии ==========
 COMMENT ON TABLE chats IS 'Чаты в MAX мессенджере';
 COMMENT ON TABLE tasks IS 'Задачи, создаваемые и управляемые в чатах';
 COMMENT ON TABLE users IS 'Пользователи бота с настройками ритуалов';
 COMMENT ON TABLE mood_logs IS 'История записей самочувствия пользователей';
+COMMENT ON TABLE bot_state IS 'Служебное состояние бота (marker long polling и т.п.)';
+COMMENT ON TABLE processed_updates IS 'Журнал обработанных обновлений для защиты от повторов';
+COMMENT ON TABLE update_queue IS 'Общая очередь обновлений для нескольких экземпляров бота';
+COMMENT ON TABLE upload_cache IS 'Загруженные в MAX изображения для повторного использования';
+COMMENT ON TABLE outbox IS 'Исходящие сообщения, записанные в одной транзакции с изменением данных';
 COMMENT ON COLUMN mood_logs.mood_level IS '1=Апатия, 2=Пассивность, 3=Расслабленность, 4=Баланс, 5=Включенность, 6=Перевозбужденность, 7=Паника';
 
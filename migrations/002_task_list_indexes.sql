@@ -0,0 +1,34 @@
+-- migrate:no-transaction
+-- Индексы под реальные запросы списков задач
+-- Строятся CONCURRENTLY, чтобы не блокировать запись в tasks
+
+-- Активные задачи чата: WHERE chat_id = $1 AND status = 'active'
+-- ORDER BY deadline ASC NULLS LAST, created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_chat_active_deadline
+  ON tasks (chat_id, deadline ASC NULLS LAST, created_at DESC)
+  WHERE status = 'active';
+
+-- Активные задачи пользователя: (creator_id = $2 OR assignee_id = $2)
+-- в чате - BitmapOr по двум индексам
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_creator_chat_active
+  ON tasks (creator_id, chat_id)
+  WHERE status = 'active';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_assignee_chat_active
+  ON tasks (assignee_id, chat_id)
+  WHERE status = 'active' AND assignee_id IS NOT NULL;
+
+-- Архив чата: WHERE chat_id = $1 AND status IN ('completed', 'archived')
+-- ORDER BY completed_at DESC NULLS LAST, created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_chat_closed_completed
+  ON tasks (chat_id, completed_at DESC NULLS LAST, created_at DESC)
+  WHERE status IN ('completed', 'archived');
+
+-- Одиночные индексы, которые не подходят ни одному запросу.
+-- idx_tasks_chat_id остается: он нужен для ON DELETE CASCADE от chats.
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_status;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_deadline;
+
+-- Дубликаты индексов, которые уже создают ограничения UNIQUE
+DROP INDEX CONCURRENTLY IF EXISTS idx_chats_max_chat_id;
+DROP INDEX CONCURRENTLY IF EXISTS idx_users_max_user_id;
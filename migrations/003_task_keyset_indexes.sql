@@ -0,0 +1,16 @@
+-- migrate:no-transaction
+-- Индексы под постраничные (keyset) списки задач
+-- Ключ сортировки совпадает с запросами repository.TASK_LISTINGS:
+-- NULL заменен на +-infinity, в конце created_at DESC, id DESC
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_chat_active_page
+  ON tasks (chat_id, COALESCE(deadline, 'infinity'), created_at DESC, id DESC)
+  WHERE status = 'active';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_chat_closed_page
+  ON tasks (chat_id, COALESCE(completed_at, '-infinity') DESC, created_at DESC, id DESC)
+  WHERE status IN ('completed', 'archived');
+
+-- Заменены индексами выше
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_chat_active_deadline;
+DROP INDEX CONCURRENTLY IF EXISTS idx_tasks_chat_closed_completed;
@@ -0,0 +1,150 @@
+-- Помесячное секционирование mood_logs, дневные агрегаты самочувствия
+-- и холодный архив закрытых задач
+
+-- ========== mood_logs: секции по месяцам ==========
+ALTER TABLE mood_logs RENAME TO mood_logs_legacy;
+ALTER INDEX IF EXISTS mood_logs_pkey RENAME TO mood_logs_legacy_pkey;
+DROP INDEX IF EXISTS idx_mood_logs_user_id;
+DROP INDEX IF EXISTS idx_mood_logs_logged_at;
+
+CREATE TABLE mood_logs (
+  id              BIGINT NOT NULL DEFAULT nextval('mood_logs_id_seq'),
+  user_id         BIGINT NOT NULL REFERENCES users(max_user_id) ON DELETE CASCADE,
+  mood_level      INT NOT NULL CHECK (mood_level >= 1 AND mood_level <= 7),
+  ritual_type     VARCHAR(20) NOT NULL,            -- 'morning' или 'evening'
+  notes           TEXT,                            -- Опциональные заметки
+  logged_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (id, logged_at)
+) PARTITION BY RANGE (logged_at);
+
+-- Последовательность остается за новой таблицей (иначе удалится вместе со старой)
+ALTER SEQUENCE mood_logs_id_seq OWNED BY mood_logs.id;
+
+CREATE INDEX idx_mood_logs_user_logged_at ON mood_logs (user_id, logged_at);
+
+-- Секция для строк вне созданных месяцев. Должна оставаться пустой: задача
+-- обслуживания заранее создает секции на несколько месяцев вперед
+CREATE TABLE mood_logs_default PARTITION OF mood_logs DEFAULT;
+
+-- Создать секции от месяца from_month до текущего месяца + months_ahead
+CREATE OR REPLACE FUNCTION ensure_mood_log_partitions(months_ahead INT, from_month DATE DEFAULT NULL)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  month_start DATE := date_trunc('month', COALESCE(from_month, CURRENT_DATE))::date;
+  last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+  partition_name TEXT;
+  created INT := 0;
+BEGIN
+  WHILE month_start <= last_month LOOP
+    partition_name := 'mood_logs_p' || to_char(month_start, 'YYYYMM');
+    IF to_regclass(partition_name) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE %I PARTITION OF mood_logs FOR VALUES FROM (%L) TO (%L)',
+        partition_name,
+        month_start::timestamptz,
+        (month_start + INTERVAL '1 month')::timestamptz
+      );
+      created := created + 1;
+    END IF;
+    month_start := (month_start + INTERVAL '1 month')::date;
+  END LOOP;
+  RETURN created;
+END;
+$$;
+
+SELECT ensure_mood_log_partitions(
+  2,
+  (SELECT MIN(logged_at)::date FROM mood_logs_legacy)
+);
+
+INSERT INTO mood_logs (id, user_id, mood_level, ritual_type, notes, logged_at)
+SELECT id, user_id, mood_level, ritual_type, notes, COALESCE(logged_at, NOW())
+FROM mood_logs_legacy;
+
+DROP TABLE mood_logs_legacy;
+
+-- ========== Дневные агрегаты самочувствия ==========
+CREATE TABLE IF NOT EXISTS mood_daily (
+  user_id         BIGINT NOT NULL REFERENCES users(max_user_id) ON DELETE CASCADE,
+  day             DATE NOT NULL,                   -- День по UTC
+  ritual_type     VARCHAR(20) NOT NULL,
+  entries         INT NOT NULL,                    -- Число ответов
+  mood_sum        INT NOT NULL,                    -- Сумма уровней (для среднего)
+  level_counts    INT[] NOT NULL,                  -- Число ответов по уровням 1..7
+  PRIMARY KEY (user_id, day, ritual_type)
+);
+
+-- Свернуть в mood_daily и удалить секции старше keep_months полных месяцев
+-- (дни, уже имеющие агрегат, не пересчитываются)
+CREATE OR REPLACE FUNCTION compact_mood_log_partitions(keep_months INT)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => keep_months))::date;
+  part RECORD;
+  dropped INT := 0;
+BEGIN
+  FOR part IN
+    SELECT c.relname, to_date(substring(c.relname FROM 'mood_logs_p(\d{6})$'), 'YYYYMM') AS month_start
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'mood_logs'::regclass
+      AND c.relname ~ '^mood_logs_p\d{6}$'
+  LOOP
+    CONTINUE WHEN part.month_start >= cutoff;
+
+    EXECUTE format($sql$
+      INSERT INTO mood_daily (user_id, day, ritual_type, entries, mood_sum, level_counts)
+      SELECT
+        user_id,
+        (logged_at AT TIME ZONE 'UTC')::date,
+        ritual_type,
+        COUNT(*),
+        SUM(mood_level),
+        ARRAY[
+          COUNT(*) FILTER (WHERE mood_level = 1), COUNT(*) FILTER (WHERE mood_level = 2),
+          COUNT(*) FILTER (WHERE mood_level = 3), COUNT(*) FILTER (WHERE mood_level = 4),
+          COUNT(*) FILTER (WHERE mood_level = 5), COUNT(*) FILTER (WHERE mood_level = 6),
+          COUNT(*) FILTER (WHERE mood_level = 7)
+        ]::INT[]
+      FROM %I
+      GROUP BY 1, 2, 3
+      ON CONFLICT (user_id, day, ritual_type) DO NOTHING
+    $sql$, part.relname);
+
+    EXECUTE format('DROP TABLE %I', part.relname);
+    dropped := dropped + 1;
+  END LOOP;
+  RETURN dropped;
+END;
+$$;
+
+-- ========== Холодный архив задач ==========
+-- Закрытые задачи переносятся сюда спустя TASK_ARCHIVE_AFTER_DAYS,
+-- чтобы таблица tasks и ее индексы содержали в основном активные задачи
+CREATE TABLE IF NOT EXISTS tasks_archive (
+  id           BIGINT PRIMARY KEY,                -- Тот же ID, что был в tasks
+  chat_id      BIGINT NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+  creator_id   BIGINT NOT NULL,
+  assignee_id  BIGINT,
+  title        VARCHAR(500) NOT NULL,
+  description  TEXT,
+  tag          VARCHAR(100),
+  status       VARCHAR(20) NOT NULL,              -- completed, archived
+  created_at   TIMESTAMPTZ,
+  deadline     TIMESTAMPTZ,
+  completed_at TIMESTAMPTZ,
+  reminder_at  TIMESTAMPTZ,
+  archived_at  TIMESTAMPTZ NOT NULL DEFAULT NOW() -- Когда перенесена в архив
+);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_archive_chat_page
+  ON tasks_archive (chat_id, COALESCE(completed_at, '-infinity') DESC, created_at DESC, id DESC);
+
+COMMENT ON TABLE mood_logs IS 'История записей самочувствия пользователей (секции по месяцам)';
+COMMENT ON TABLE mood_daily IS 'Дневные агрегаты самочувствия (переживают удаление старых секций mood_logs)';
+COMMENT ON TABLE tasks_archive IS 'Холодный архив давно закрытых задач';
+COMMENT ON COLUMN mood_logs.mood_level IS '1=Апатия, 2=Пассивность, 3=Расслабленность, 4=Баланс, 5=Включенность, 6=Перевозбужденность, 7=Паника';
@@ -0,0 +1,20 @@
+-- Дневные агрегаты самочувствия обновляются при каждой записи в mood_logs.
+-- Заполняем их по уже накопленным записям; дни, свернутые при удалении
+-- старых секций, уже есть в mood_daily и не трогаются.
+
+INSERT INTO mood_daily (user_id, day, ritual_type, entries, mood_sum, level_counts)
+SELECT
+  user_id,
+  (logged_at AT TIME ZONE 'UTC')::date,
+  ritual_type,
+  COUNT(*),
+  SUM(mood_level),
+  ARRAY[
+    COUNT(*) FILTER (WHERE mood_level = 1), COUNT(*) FILTER (WHERE mood_level = 2),
+    COUNT(*) FILTER (WHERE mood_level = 3), COUNT(*) FILTER (WHERE mood_level = 4),
+    COUNT(*) FILTER (WHERE mood_level = 5), COUNT(*) FILTER (WHERE mood_level = 6),
+    COUNT(*) FILTER (WHERE mood_level = 7)
+  ]::INT[]
+FROM mood_logs
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, day, ritual_type) DO NOTHING;
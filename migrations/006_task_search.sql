@@ -0,0 +1,34 @@
+-- migrate:no-transaction
+-- Полнотекстовый поиск по задачам (/найти, GET /chats/{chat_id}/tasks/search)
+--
+-- Индексы строятся по выражению (как SEARCH_VECTOR в repository.py), а не по
+-- сохраняемой генерируемой колонке: ADD COLUMN ... GENERATED STORED
+-- переписал бы tasks и tasks_archive целиком под ACCESS EXCLUSIVE. Индексы
+-- создаются CONCURRENTLY и не блокируют запись. Выражение в запросах должно
+-- совпадать с выражением индекса.
+
+-- btree_gin - чтобы chat_id был в том же GIN индексе, что и текст;
+-- pg_trgm - нечеткий поиск по названию при опечатках
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Вес: название важнее тега, тег важнее описания
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_search
+  ON tasks USING GIN (chat_id, (
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(tag, '')), 'B') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'C')
+  ));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_archive_search
+  ON tasks_archive USING GIN (chat_id, (
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(tag, '')), 'B') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'C')
+  ));
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_title_trgm
+  ON tasks USING GIN (chat_id, title gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tasks_archive_title_trgm
+  ON tasks_archive USING GIN (chat_id, title gin_trgm_ops);
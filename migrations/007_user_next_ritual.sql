@@ -0,0 +1,9 @@
+-- migrate:no-transaction
+-- Ближайший ритуал пользователя в UTC: планировщик выбирает по индексу
+-- только тех, кому пора, вместо чтения всех пользователей каждую минуту
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS next_ritual_at TIMESTAMPTZ;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS next_ritual_type VARCHAR(20);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_next_ritual_at
+  ON users (next_ritual_at) WHERE next_ritual_at IS NOT NULL;
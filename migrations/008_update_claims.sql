@@ -0,0 +1,9 @@
+-- Журнал обновлений хранит не только обработанные, но и захваченные обновления:
+-- запись создается при начале обработки с арендой claimed_until и помечается
+-- обработанной (claimed_until = NULL) только после успешной обработки.
+-- Если экземпляр упал посреди обработки, после истечения аренды обновление
+-- снова можно захватить. Существующие записи - обработанные.
+
+ALTER TABLE processed_updates ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMPTZ;
+
+COMMENT ON COLUMN processed_updates.claimed_until IS 'Аренда обработки; NULL - обновление обработано';
@@ -0,0 +1,4 @@
+-- Сколько раз обновление из update_queue выдавалось обработчикам:
+-- больше одного - повторная выдача после сбоя экземпляра
+
+ALTER TABLE update_queue ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0;
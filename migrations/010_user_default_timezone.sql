@@ -0,0 +1,13 @@
+-- Часовой пояс по умолчанию - пояс сервера (RITUAL_DEFAULT_TIMEZONE), а не UTC:
+-- до появления /пояс время ритуалов отсчитывалось по времени сервера.
+-- 'UTC' у существующих пользователей - значение по умолчанию из 001, а не
+-- выбор пользователя, поэтому сбрасывается в NULL. Ближайший ритуал
+-- пересчитывается при запуске планировщика (schedule_unscheduled_rituals).
+
+ALTER TABLE users ALTER COLUMN timezone DROP DEFAULT;
+
+UPDATE users SET timezone = NULL WHERE timezone = 'UTC';
+
+UPDATE users
+SET next_ritual_at = NULL, next_ritual_type = NULL
+WHERE timezone IS NULL AND next_ritual_at IS NOT NULL;
@@ -0,0 +1,48 @@
+-- Секция месяца не создается, пока в mood_logs_default есть строки этого
+-- месяца (например, записи с неверными часами или после простоя задачи
+-- обслуживания): CREATE TABLE ... PARTITION OF падает, и секции перестают
+-- создаваться. Теперь такие строки переносятся в новую секцию в той же
+-- транзакции.
+
+CREATE OR REPLACE FUNCTION ensure_mood_log_partitions(months_ahead INT, from_month DATE DEFAULT NULL)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  month_start DATE := date_trunc('month', COALESCE(from_month, CURRENT_DATE))::date;
+  last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+  range_start TIMESTAMPTZ;
+  range_end TIMESTAMPTZ;
+  partition_name TEXT;
+  created INT := 0;
+BEGIN
+  WHILE month_start <= last_month LOOP
+    partition_name := 'mood_logs_p' || to_char(month_start, 'YYYYMM');
+    range_start := month_start::timestamptz;
+    range_end := (month_start + INTERVAL '1 month')::timestamptz;
+    IF to_regclass(partition_name) IS NULL THEN
+      -- Новые строки этого месяца не попадут в DEFAULT, пока секция создается
+      LOCK TABLE mood_logs_default IN EXCLUSIVE MODE;
+
+      CREATE TEMP TABLE mood_logs_moving ON COMMIT DROP AS
+        SELECT * FROM mood_logs_default
+        WHERE logged_at >= range_start AND logged_at < range_end;
+      DELETE FROM mood_logs_default
+      WHERE logged_at >= range_start AND logged_at < range_end;
+
+      EXECUTE format(
+        'CREATE TABLE %I PARTITION OF mood_logs FOR VALUES FROM (%L) TO (%L)',
+        partition_name,
+        range_start,
+        range_end
+      );
+
+      INSERT INTO mood_logs SELECT * FROM mood_logs_moving;
+      DROP TABLE mood_logs_moving;
+      created := created + 1;
+    END IF;
+    month_start := (month_start + INTERVAL '1 month')::date;
+  END LOOP;
+  RETURN created;
+END;
+$$;
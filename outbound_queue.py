@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Очередь исходящих запросов к MAX API с ограничением скорости
+
+Каждый запрос к API берет токен общего token bucket (throttle()), каждое
+сообщение - токен bucket своего получателя. Ответы 429 и 5xx повторяются с
+экспоненциальной задержкой, заголовок Retry-After учитывается.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Hashable, Optional
+
+import httpx
+
+from cache import LRUCache
+from dispatcher import KeyedDispatcher
+
+logger = logging.getLogger(__name__)
+
+# Попытка отправки: выполняет запрос и возвращает ответ API
+SendAttempt = Callable[[], Awaitable[httpx.Response]]
+
+
+class TokenBucket:
+    """Token bucket: не более rate операций в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float):
+        """Не выдавать токены ближайшие seconds секунд (например, после 429)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        """Дождаться токена (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разобрать заголовок Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(response: httpx.Response) -> bool:
+    """Можно ли повторить запрос с таким ответом"""
+    if response.status_code == 429 or response.status_code >= 500:
+        return True
+    # Вложение еще обрабатывается сервером MAX после загрузки
+    return response.status_code == 400 and "attachment.not.ready" in response.text
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих сообщений
+
+    put() ставит попытку отправки в очередь и сразу возвращает управление.
+    Сообщения одному получателю уходят по порядку, разным - параллельно
+    (не более workers запросов одновременно). Ожидание лимита получателя и
+    пауза перед повтором не занимают воркер: сообщения других получателей
+    в это время отправляются.
+
+    Попытка отправки сама вызывает throttle() перед каждым запросом к API,
+    поэтому отправка из нескольких запросов (загрузка + сообщение) тратит
+    столько же токенов общего лимита.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        global_rate: float,
+        global_burst: float,
+        recipient_rate: float,
+        recipient_burst: float,
+        max_attempts: int = 5,
+        max_pending: int = 10000,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        recipients_cache_size: int = 10000
+    ):
+        # Порядок по получателю держит диспетчер; параллелизм запросов к API
+        # ограничивает _workers, который занят только на время самой попытки
+        self._dispatcher = KeyedDispatcher(self._deliver, max_pending, name="outbound")
+        self._workers = asyncio.Semaphore(max(1, workers))
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._recipient_buckets = LRUCache(recipients_cache_size)
+        self._recipient_rate = recipient_rate
+        self._recipient_burst = recipient_burst
+        self._max_attempts = max(1, max_attempts)
+        self._slots = asyncio.Semaphore(max_pending)
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+
+    @property
+    def pending_count(self) -> int:
+        """Количество сообщений, ожидающих отправки"""
+        return self._dispatcher.pending_count
+
+    async def put(self, recipient: Hashable, attempt: SendAttempt) -> asyncio.Future:
+        """
+        Поставить отправку в очередь
+
+        Ждет только при переполнении очереди (backpressure).
+
+        Returns:
+            Future с результатом доставки (True/False)
+        """
+        await self._slots.acquire()
+        done = self._dispatcher.submit(recipient, (recipient, attempt))
+        done.add_done_callback(lambda _: self._slots.release())
+        return done
+
+    async def throttle(self):
+        """Дождаться токена общего лимита на один запрос к API"""
+        await self._global_bucket.acquire()
+
+    async def join(self, timeout: Optional[float] = None):
+        """Дождаться отправки всех сообщений в очереди"""
+        try:
+            await asyncio.wait_for(self._dispatcher.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не дождались отправки {self.pending_count} сообщений")
+
+    async def close(self):
+        """Остановить отправку"""
+        await self._dispatcher.close()
+
+    def _recipient_bucket(self, recipient: Hashable) -> TokenBucket:
+        bucket = self._recipient_buckets.get(recipient)
+        if bucket is None:
+            bucket = TokenBucket(self._recipient_rate, self._recipient_burst)
+            self._recipient_buckets.set(recipient, bucket)
+        return bucket
+
+    def _backoff(self, attempt_number: int) -> float:
+        delay = min(self._backoff_max, self._backoff_base * (2 ** attempt_number))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, item) -> bool:
+        """Отправить сообщение с учетом лимитов и повторов"""
+        recipient, attempt = item
+        delay = 0.0
+
+        for attempt_number in range(self._max_attempts):
+            if attempt_number:
+                await asyncio.sleep(delay)
+
+            await self._recipient_bucket(recipient).acquire()
+
+            try:
+                async with self._workers:
+                    response = await attempt()
+            except httpx.HTTPError as e:
+                delay = self._backoff(attempt_number)
+                logger.warning(f"⚠️ Ошибка сети при отправке {recipient}: {e}")
+                continue
+
+            if response.status_code == 200:
+                return True
+
+            if not is_retryable(response):
+                logger.error(f"❌ Ошибка отправки сообщения {recipient}: {response.status_code} - {response.text}")
+                return False
+
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+            if delay is None:
+                delay = self._backoff(attempt_number)
+            if response.status_code == 429:
+                # Лимит API общий для бота - притормаживаем все отправки
+                self._global_bucket.pause(delay)
+
+            logger.warning(
+                f"⚠️ MAX API ответил {response.status_code} для {recipient}, "
+                f"повтор через {delay:.1f} с"
+            )
+
+        logger.error(f"❌ Сообщение для {recipient} не отправлено после {self._max_attempts} попыток")
+        return False
@@ -0,0 +1,837 @@
+#!/usr/bin/env python3
+"""
+Общий слой доступа к задачам, чатам и статистике самочувствия
+
+Используется и FastAPI приложением (bot_with_db.py), и ботом
+(longpolling_bot.py). Горячие запросы подготавливаются один раз на каждое
+соединение пула (хук init), поэтому при вызове не тратится время на
+разбор и планирование SQL.
+"""
+
+import base64
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional
+
+import asyncpg
+
+from cache import LRUCache
+
+# Поля задачи, которые отдаются наружу
+TASK_COLUMNS = """
+    t.id, t.chat_id, t.creator_id, t.assignee_id,
+    t.title, t.description, t.tag, t.status,
+    t.created_at, t.deadline, t.reminder_at, t.completed_at
+"""
+
+# Колонки tasks, которые заполняет массовый импорт (COPY)
+IMPORT_COLUMNS = [
+    "chat_id", "creator_id", "assignee_id", "title", "description",
+    "tag", "deadline", "reminder_at", "status",
+]
+
+# Сколько раз повторять upsert чата, если параллельно вставленная строка еще
+# не видна снимку запроса (второй попытки достаточно)
+UPSERT_ATTEMPTS = 3
+
+# Запросы, подготавливаемые на каждом соединении пула
+STATEMENTS: Dict[str, str] = {
+    # Один запрос вместо SELECT + INSERT, без гонки на UNIQUE при параллельных
+    # вставках. DO NOTHING не переписывает существующую строку (DO UPDATE
+    # оставлял бы мертвую версию и запись в WAL на каждый промах кэша), ее id
+    # берется обычным SELECT. Чат, вставленный параллельной транзакцией, снимку
+    # этого запроса не виден - тогда строк нет и запрос повторяется.
+    "upsert_chat": """
+        WITH inserted AS (
+            INSERT INTO chats (max_chat_id, name) VALUES ($1, $2)
+            ON CONFLICT (max_chat_id) DO NOTHING
+            RETURNING id
+        )
+        SELECT id FROM inserted
+        UNION ALL
+        SELECT id FROM chats WHERE max_chat_id = $1
+    """,
+    # Несколько чатов одним запросом (массовый импорт)
+    "upsert_chats": """
+        WITH requested AS (
+            SELECT DISTINCT max_chat_id FROM unnest($1::text[]) AS max_chat_id
+        ), inserted AS (
+            INSERT INTO chats (max_chat_id, name)
+            SELECT max_chat_id, 'Chat ' || max_chat_id FROM requested
+            ON CONFLICT (max_chat_id) DO NOTHING
+            RETURNING id, max_chat_id
+        )
+        SELECT id, max_chat_id FROM inserted
+        UNION ALL
+        SELECT c.id, c.max_chat_id FROM chats c JOIN requested r ON r.max_chat_id = c.max_chat_id
+    """,
+    # Все задачи чата для выгрузки, включая холодный архив
+    "export_chat_tasks": f"""
+        SELECT {TASK_COLUMNS} FROM tasks t WHERE t.chat_id = $1
+        UNION ALL
+        SELECT {TASK_COLUMNS} FROM tasks_archive t WHERE t.chat_id = $1
+    """,
+    # Дневные агрегаты самочувствия пользователя начиная с дня $2
+    "mood_daily": """
+        SELECT day, ritual_type, entries, mood_sum, level_counts
+        FROM mood_daily
+        WHERE user_id = $1 AND day >= $2
+    """,
+    # Задача ищется и в холодном архиве
+    "get_task": f"""
+        SELECT {TASK_COLUMNS} FROM tasks t WHERE t.id = $1
+        UNION ALL
+        SELECT {TASK_COLUMNS} FROM tasks_archive t WHERE t.id = $1
+        LIMIT 1
+    """,
+    "create_task": f"""
+        INSERT INTO tasks AS t (
+            chat_id, creator_id, assignee_id, title, description,
+            tag, deadline, reminder_at, status
+        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, 'active')
+        RETURNING {TASK_COLUMNS}
+    """,
+    # Чат еще не в кэше: создание чата и задачи одним запросом
+    "create_chat_task": f"""
+        WITH chat AS (
+            INSERT INTO chats (max_chat_id, name) VALUES ($1::text, 'Chat ' || $1::text)
+            ON CONFLICT (max_chat_id) DO UPDATE SET max_chat_id = EXCLUDED.max_chat_id
+            RETURNING id
+        )
+        INSERT INTO tasks AS t (
+            chat_id, creator_id, assignee_id, title, description,
+            tag, deadline, reminder_at, status
+        )
+        SELECT chat.id, $2, $3, $4, $5, $6, $7, $8, 'active' FROM chat
+        RETURNING {TASK_COLUMNS}
+    """,
+    # Проверка доступа и обновление одним запросом для любого числа задач
+    "complete_user_tasks": """
+        UPDATE tasks
+        SET status = 'completed', completed_at = $3
+        WHERE id = ANY($1::bigint[])
+            AND (creator_id = $2 OR assignee_id = $2)
+            AND status = 'active'
+        RETURNING id
+    """,
+    # $4 - пользователь, от имени которого меняется статус (NULL - без проверки доступа).
+    # Задачи из холодного архива возвращаются в tasks уже с новым статусом
+    # (если они снова закрыты, задача архивации перенесет их обратно).
+    "set_tasks_status": f"""
+        WITH restored AS (
+            DELETE FROM tasks_archive
+            WHERE id = ANY($1::bigint[])
+                AND ($4::bigint IS NULL OR creator_id = $4 OR assignee_id = $4)
+            RETURNING *
+        ), reinserted AS (
+            INSERT INTO tasks AS t (
+                id, chat_id, creator_id, assignee_id, title, description,
+                tag, status, created_at, deadline, completed_at, reminder_at
+            )
+            SELECT
+                id, chat_id, creator_id, assignee_id, title, description,
+                tag, $2, created_at, deadline, $3, reminder_at
+            FROM restored
+            RETURNING {TASK_COLUMNS}
+        ), updated AS (
+            UPDATE tasks AS t
+            SET status = $2, completed_at = $3
+            WHERE t.id = ANY($1::bigint[])
+                AND ($4::bigint IS NULL OR t.creator_id = $4 OR t.assignee_id = $4)
+            RETURNING {TASK_COLUMNS}
+        )
+        SELECT * FROM updated
+        UNION ALL
+        SELECT * FROM reinserted
+    """,
+    "reassign_tasks": """
+        WITH hot AS (
+            UPDATE tasks
+            SET assignee_id = $2
+            WHERE id = ANY($1::bigint[])
+                AND ($3::bigint IS NULL OR creator_id = $3 OR assignee_id = $3)
+            RETURNING id
+        ), cold AS (
+            UPDATE tasks_archive
+            SET assignee_id = $2
+            WHERE id = ANY($1::bigint[])
+                AND ($3::bigint IS NULL OR creator_id = $3 OR assignee_id = $3)
+            RETURNING id
+        )
+        SELECT id FROM hot
+        UNION ALL
+        SELECT id FROM cold
+    """,
+    # Перенести пачку давно закрытых задач в холодный архив
+    "archive_closed_tasks": """
+        WITH moved AS (
+            DELETE FROM tasks
+            WHERE id IN (
+                SELECT id FROM tasks
+                WHERE status IN ('completed', 'archived')
+                    AND COALESCE(completed_at, created_at) < NOW() - make_interval(days => $1)
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        )
+        INSERT INTO tasks_archive (
+            id, chat_id, creator_id, assignee_id, title, description,
+            tag, status, created_at, deadline, completed_at, reminder_at
+        )
+        SELECT
+            id, chat_id, creator_id, assignee_id, title, description,
+            tag, status, created_at, deadline, completed_at, reminder_at
+        FROM moved
+    """,
+}
+
+
+# ========== Keyset Pagination ==========
+
+# Постраничные списки задач: таблицы, условие, число его параметров и ключ
+# сортировки (колонка, значение вместо NULL, по убыванию ли). Порядок внутри
+# ключа - created_at DESC, id DESC, поэтому страницы стабильны при равных ключах.
+TASK_LISTINGS = {
+    "active_tasks": (
+        ("tasks",),
+        "t.chat_id = $1 AND t.status = 'active'",
+        1, "deadline", "infinity", False
+    ),
+    # Архив чата: недавно закрытые задачи в tasks, давние - в tasks_archive
+    "archived_tasks": (
+        ("tasks", "tasks_archive"),
+        "t.chat_id = $1 AND t.status IN ('completed', 'archived')",
+        1, "completed_at", "-infinity", True
+    ),
+    "user_tasks": (
+        ("tasks",),
+        "t.chat_id = $1 AND (t.creator_id = $2 OR t.assignee_id = $2) AND t.status = 'active'",
+        2, "deadline", "infinity", False
+    ),
+}
+
+
+def _keyset_statements(
+    name: str,
+    tables: tuple,
+    where: str,
+    params: int,
+    column: str,
+    null_value: str,
+    descending: bool
+) -> Dict[str, str]:
+    """
+    Запросы первой, следующей и предыдущей страниц списка
+
+    NULL в ключе заменяется на +-infinity (NULLS LAST), чтобы сравнение
+    с курсором и индекс работали с обычными операторами. Если таблиц
+    несколько, страница выбирается из каждой и объединяется.
+    """
+    key = f"COALESCE(t.{column}, '{null_value}')"
+    key_param, created_param, id_param, limit_param = (f"${params + n}" for n in range(1, 5))
+    cursor_key = f"COALESCE({key_param}::timestamptz, '{null_value}')"
+
+    forward = f"{key} {'DESC' if descending else 'ASC'}, t.created_at DESC, t.id DESC"
+    backward = f"{key} {'ASC' if descending else 'DESC'}, t.created_at ASC, t.id ASC"
+
+    def seek(key_op: str, tail_op: str) -> str:
+        return (
+            f"{key} {key_op}= {cursor_key} AND ({key} {key_op} {cursor_key} OR "
+            f"({key} = {cursor_key} AND (t.created_at, t.id) {tail_op} ({created_param}, {id_param})))"
+        )
+
+    after = seek("<" if descending else ">", "<")
+    before = seek(">" if descending else "<", ">")
+
+    def page(condition: str, order: str, limit: str) -> str:
+        selects = [
+            f"(SELECT {TASK_COLUMNS} FROM {table} t WHERE {condition} ORDER BY {order} LIMIT {limit})"
+            for table in tables
+        ]
+        if len(selects) == 1:
+            return selects[0]
+        union = " UNION ALL ".join(selects)
+        return f"SELECT {TASK_COLUMNS} FROM ({union}) t ORDER BY {order} LIMIT {limit}"
+
+    return {
+        f"{name}_first": page(where, forward, f"${params + 1}"),
+        f"{name}_after": page(f"{where} AND {after}", forward, limit_param),
+        f"{name}_before": page(f"{where} AND {before}", backward, limit_param),
+    }
+
+
+for _name, _listing in TASK_LISTINGS.items():
+    STATEMENTS.update(_keyset_statements(_name, *_listing))
+
+
+# ========== Task Search ==========
+
+# Текст задачи для полнотекстового поиска. Должен совпадать с выражением
+# индексов idx_tasks_search / idx_tasks_archive_search (миграция 006)
+SEARCH_VECTOR = (
+    "(setweight(to_tsvector('russian', coalesce(t.title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(t.tag, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(t.description, '')), 'C'))"
+)
+
+# Режимы поиска: условие совпадения и релевантность ($1 - чат, $2 - запрос).
+# fulltext - по словоформам (GIN по SEARCH_VECTOR), fuzzy - по триграммам
+# названия, когда полнотекстовый поиск ничего не нашел (опечатки)
+SEARCH_MODES = {
+    "fulltext": (
+        f"{SEARCH_VECTOR} @@ websearch_to_tsquery('russian', $2::text)",
+        f"ts_rank({SEARCH_VECTOR}, websearch_to_tsquery('russian', $2::text))::float8",
+    ),
+    "fuzzy": (
+        "$2::text <% t.title",
+        "word_similarity($2::text, t.title)::float8",
+    ),
+}
+
+
+def _search_statements(mode: str, match: str, rank: str) -> Dict[str, str]:
+    """
+    Запросы первой и следующей страниц поиска по задачам чата
+
+    Порядок - rank DESC, id DESC; курсор хранит rank и id последней задачи.
+    Ищется и в tasks, и в холодном архиве.
+    """
+    def page(condition: str, limit: str) -> str:
+        selects = [
+            f"(SELECT {TASK_COLUMNS}, {rank} AS rank FROM {table} t "
+            f"WHERE t.chat_id = $1 AND {match}{condition} "
+            f"ORDER BY rank DESC, t.id DESC LIMIT {limit})"
+            for table in ("tasks", "tasks_archive")
+        ]
+        union = " UNION ALL ".join(selects)
+        return f"SELECT {TASK_COLUMNS}, t.rank FROM ({union}) t ORDER BY t.rank DESC, t.id DESC LIMIT {limit}"
+
+    return {
+        f"search_{mode}_first": page("", "$3"),
+        f"search_{mode}_after": page(f" AND ({rank}, t.id) < ($3, $4)", "$5"),
+    }
+
+
+for _mode, _search in SEARCH_MODES.items():
+    STATEMENTS.update(_search_statements(_mode, *_search))
+
+
+class Page(NamedTuple):
+    """Страница списка задач с курсорами соседних страниц"""
+    items: List[dict]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def encode_cursor(task: dict, column: str, direction: str) -> str:
+    """Курсор на позицию задачи (direction: next - после нее, prev - перед ней)"""
+    key = task[column]
+    payload = [
+        direction,
+        key.isoformat() if key else None,
+        task['created_at'].isoformat(),
+        task['id'],
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Разобрать курсор
+
+    Raises:
+        ValueError: если курсор поврежден
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, key, created_at, task_id = json.loads(raw)
+        if direction not in ("next", "prev") or not isinstance(task_id, int):
+            raise ValueError(cursor)
+        return (
+            direction,
+            datetime.fromisoformat(key) if key else None,
+            datetime.fromisoformat(created_at),
+            task_id,
+        )
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+class SearchPage(NamedTuple):
+    """Страница результатов поиска (mode - каким способом найдено)"""
+    items: List[dict]
+    next_cursor: Optional[str]
+    mode: str
+
+
+def encode_search_cursor(task: dict, mode: str) -> str:
+    """Курсор поиска на позицию после задачи"""
+    raw = json.dumps([mode, task['rank'], task['id']], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> tuple:
+    """
+    Разобрать курсор поиска
+
+    Raises:
+        ValueError: если курсор поврежден
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        mode, rank, task_id = json.loads(raw)
+        if mode not in SEARCH_MODES or not isinstance(rank, (int, float)) or not isinstance(task_id, int):
+            raise ValueError(cursor)
+        return mode, float(rank), task_id
+    except (TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
+# ========== Mood Statistics ==========
+
+# Периоды статистики самочувствия: название -> число дней (включая сегодня)
+MOOD_PERIODS = {"week": 7, "month": 30}
+
+
+def _average(total: int, entries: int) -> Optional[float]:
+    return round(total / entries, 2) if entries else None
+
+
+def summarize_mood(rows: List[dict], since: date, days: int) -> dict:
+    """Свести дневные агрегаты с дня since: среднее, распределение, утро/вечер"""
+    levels = [0] * 7
+    rituals = {"morning": [0, 0], "evening": [0, 0]}
+    for row in rows:
+        if row['day'] < since:
+            continue
+        totals = rituals.setdefault(row['ritual_type'], [0, 0])
+        totals[0] += row['entries']
+        totals[1] += row['mood_sum']
+        for index, count in enumerate(row['level_counts']):
+            levels[index] += count
+
+    entries = sum(totals[0] for totals in rituals.values())
+    mood_sum = sum(totals[1] for totals in rituals.values())
+    return {
+        "days": days,
+        "entries": entries,
+        "average": _average(mood_sum, entries),
+        "levels": {level: count for level, count in enumerate(levels, 1)},
+        "morning": {"entries": rituals["morning"][0], "average": _average(rituals["morning"][1], rituals["morning"][0])},
+        "evening": {"entries": rituals["evening"][0], "average": _average(rituals["evening"][1], rituals["evening"][0])},
+    }
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Соединение, хранящее подготовленные запросы репозитория"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+
+async def prepare_statements(conn: PreparedConnection):
+    """Хук init пула: подготовить все запросы на новом соединении"""
+    for name, sql in STATEMENTS.items():
+        conn.statements[name] = await conn.prepare(sql)
+
+
+async def create_pool(dsn: str, **kwargs) -> asyncpg.Pool:
+    """Создать пул, соединения которого готовят запросы репозитория"""
+    return await asyncpg.create_pool(
+        dsn,
+        connection_class=PreparedConnection,
+        init=prepare_statements,
+        **kwargs
+    )
+
+
+async def _statement(conn: asyncpg.Connection, name: str):
+    """Подготовленный запрос соединения (готовится при первом обращении)"""
+    statements = conn.statements
+    statement = statements.get(name)
+    if statement is None:
+        statement = statements[name] = await conn.prepare(STATEMENTS[name])
+    return statement
+
+
+class Repository:
+    """
+    Доступ к задачам и чатам
+
+    Методы, изменяющие данные, принимают необязательное соединение, чтобы
+    их можно было выполнить внутри транзакции вызывающего кода.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, chat_cache_size: int = 10000):
+        self.pool = pool
+        # Кэш id чатов: max_chat_id -> chats.id
+        self.chat_ids = LRUCache(chat_cache_size)
+
+    async def get_or_create_chat(self, max_chat_id: str, name: Optional[str] = None) -> int:
+        """
+        Получить или создать чат в БД
+
+        id чатов кэшируются в памяти: чаты не удаляются, поэтому соответствие
+        max_chat_id -> chats.id не устаревает.
+        """
+        chat_db_id = self.chat_ids.get(max_chat_id)
+        if chat_db_id is not None:
+            return chat_db_id
+
+        async with self.pool.acquire() as conn:
+            statement = await _statement(conn, "upsert_chat")
+            for _ in range(UPSERT_ATTEMPTS):
+                chat_db_id = await statement.fetchval(max_chat_id, name or f"Chat {max_chat_id}")
+                if chat_db_id is not None:
+                    break
+            else:
+                raise RuntimeError(f"Не удалось получить id чата {max_chat_id}")
+
+        self.chat_ids.set(max_chat_id, chat_db_id)
+        return chat_db_id
+
+    async def get_or_create_chats(self, max_chat_ids: Iterable[str]) -> Dict[str, int]:
+        """Получить или создать несколько чатов одним запросом"""
+        result = {}
+        missing = []
+        for max_chat_id in dict.fromkeys(max_chat_ids):
+            chat_db_id = self.chat_ids.get(max_chat_id)
+            if chat_db_id is None:
+                missing.append(max_chat_id)
+            else:
+                result[max_chat_id] = chat_db_id
+
+        if missing:
+            async with self.pool.acquire() as conn:
+                statement = await _statement(conn, "upsert_chats")
+                for _ in range(UPSERT_ATTEMPTS):
+                    for row in await statement.fetch(missing):
+                        self.chat_ids.set(row['max_chat_id'], row['id'])
+                        result[row['max_chat_id']] = row['id']
+                    missing = [max_chat_id for max_chat_id in missing if max_chat_id not in result]
+                    if not missing:
+                        break
+                else:
+                    raise RuntimeError(f"Не удалось получить id чатов {missing}")
+
+        return result
+
+    async def get_task(self, task_id: int) -> Optional[dict]:
+        """Получить задачу по ID"""
+        async with self.pool.acquire() as conn:
+            statement = await _statement(conn, "get_task")
+            row = await statement.fetchrow(task_id)
+        return dict(row) if row else None
+
+    async def get_active_tasks(self, chat_db_id: int, limit: int, cursor: Optional[str] = None) -> Page:
+        """Страница активных задач чата"""
+        return await self._page("active_tasks", (chat_db_id,), limit, cursor)
+
+    async def get_archived_tasks(self, chat_db_id: int, limit: int, cursor: Optional[str] = None) -> Page:
+        """Страница выполненных и архивированных задач чата"""
+        return await self._page("archived_tasks", (chat_db_id,), limit, cursor)
+
+    async def get_user_tasks(
+        self,
+        chat_db_id: int,
+        user_id: int,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Page:
+        """Страница активных задач пользователя в чате"""
+        return await self._page("user_tasks", (chat_db_id, user_id), limit, cursor)
+
+    async def search_tasks(
+        self,
+        chat_db_id: int,
+        query: str,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> SearchPage:
+        """
+        Поиск задач чата по названию, описанию и тегу
+
+        Сначала полнотекстовый поиск; если он ничего не нашел, на первой
+        странице выполняется нечеткий поиск по названию. Курсор запоминает
+        режим, поэтому следующие страницы передаются с тем же query.
+
+        Raises:
+            ValueError: если курсор поврежден
+        """
+        async with self.pool.acquire() as conn:
+            if cursor is None:
+                mode = "fulltext"
+                statement = await _statement(conn, "search_fulltext_first")
+                rows = await statement.fetch(chat_db_id, query, limit + 1)
+                if not rows:
+                    mode = "fuzzy"
+                    statement = await _statement(conn, "search_fuzzy_first")
+                    rows = await statement.fetch(chat_db_id, query, limit + 1)
+            else:
+                mode, rank, task_id = decode_search_cursor(cursor)
+                statement = await _statement(conn, f"search_{mode}_after")
+                rows = await statement.fetch(chat_db_id, query, rank, task_id, limit + 1)
+
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = encode_search_cursor(items[-1], mode) if len(rows) > limit else None
+        return SearchPage(items, next_cursor, mode)
+
+    async def create_task(
+        self,
+        chat_db_id: int,
+        creator_id: int,
+        title: str,
+        description: Optional[str] = None,
+        tag: Optional[str] = None,
+        assignee_id: Optional[int] = None,
+        deadline: Optional[datetime] = None,
+        reminder_at: Optional[datetime] = None,
+        conn: Optional[asyncpg.Connection] = None
+    ) -> int:
+        """Создать задачу, вернуть ее ID"""
+        if conn is None:
+            async with self.pool.acquire() as conn:
+                return await self.create_task(
+                    chat_db_id, creator_id, title, description,
+                    tag, assignee_id, deadline, reminder_at, conn
+                )
+
+        statement = await _statement(conn, "create_task")
+        return await statement.fetchval(
+            chat_db_id, creator_id, assignee_id, title,
+            description, tag, deadline, reminder_at
+        )
+
+    async def create_chat_task(
+        self,
+        max_chat_id: str,
+        creator_id: int,
+        title: str,
+        description: Optional[str] = None,
+        tag: Optional[str] = None,
+        assignee_id: Optional[int] = None,
+        deadline: Optional[datetime] = None,
+        reminder_at: Optional[datetime] = None
+    ) -> dict:
+        """
+        Создать задачу в чате MAX, вернуть созданную строку
+
+        Один запрос к БД: если id чата нет в кэше, чат создается в том же
+        запросе, что и задача.
+        """
+        chat_db_id = self.chat_ids.get(max_chat_id)
+        async with self.pool.acquire() as conn:
+            if chat_db_id is None:
+                statement = await _statement(conn, "create_chat_task")
+                row = await statement.fetchrow(
+                    max_chat_id, creator_id, assignee_id, title,
+                    description, tag, deadline, reminder_at
+                )
+            else:
+                statement = await _statement(conn, "create_task")
+                row = await statement.fetchrow(
+                    chat_db_id, creator_id, assignee_id, title,
+                    description, tag, deadline, reminder_at
+                )
+
+        task = dict(row)
+        self.chat_ids.set(max_chat_id, task['chat_id'])
+        return task
+
+    async def import_tasks(self, records: List[tuple]) -> int:
+        """
+        Загрузить задачи через COPY
+
+        Args:
+            records: кортежи значений в порядке IMPORT_COLUMNS
+
+        Returns:
+            Сколько задач загружено
+        """
+        async with self.pool.acquire() as conn:
+            result = await conn.copy_records_to_table(
+                "tasks",
+                records=records,
+                columns=IMPORT_COLUMNS
+            )
+        return int(result.split()[-1])
+
+    async def iter_chat_tasks(self, chat_db_id: int, batch_size: int) -> AsyncIterator[List[dict]]:
+        """
+        Выдавать все задачи чата пачками через серверный курсор
+
+        Список целиком в памяти не собирается; соединение занято, пока
+        идет чтение.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                statement = await _statement(conn, "export_chat_tasks")
+                batch = []
+                async for row in statement.cursor(chat_db_id, prefetch=batch_size):
+                    batch.append(dict(row))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+
+    async def complete_user_task(
+        self,
+        task_id: int,
+        user_id: int,
+        conn: Optional[asyncpg.Connection] = None
+    ) -> bool:
+        """Отметить выполненной активную задачу, к которой у пользователя есть доступ"""
+        return bool(await self.complete_user_tasks([task_id], user_id, conn))
+
+    async def complete_user_tasks(
+        self,
+        task_ids: List[int],
+        user_id: int,
+        conn: Optional[asyncpg.Connection] = None
+    ) -> List[int]:
+        """
+        Отметить выполненными активные задачи пользователя одним запросом
+
+        Returns:
+            ID задач, которые были обновлены
+        """
+        if conn is None:
+            async with self.pool.acquire() as conn:
+                return await self.complete_user_tasks(task_ids, user_id, conn)
+
+        statement = await _statement(conn, "complete_user_tasks")
+        rows = await statement.fetch(task_ids, user_id, datetime.now())
+        return [row['id'] for row in rows]
+
+    async def set_task_status(self, task_id: int, status: str) -> Optional[dict]:
+        """Установить статус задачи, вернуть обновленную строку (None - задачи нет)"""
+        completed_at = datetime.now() if status == 'completed' else None
+        async with self.pool.acquire() as conn:
+            statement = await _statement(conn, "set_tasks_status")
+            row = await statement.fetchrow([task_id], status, completed_at, None)
+        return dict(row) if row else None
+
+    async def set_tasks_status(
+        self,
+        task_ids: List[int],
+        status: str,
+        user_id: Optional[int] = None
+    ) -> List[int]:
+        """
+        Установить статус нескольким задачам одним запросом
+
+        Если указан user_id, обновляются только задачи, которые он создал
+        или на которые назначен.
+
+        Returns:
+            ID задач, которые были обновлены
+        """
+        completed_at = datetime.now() if status == 'completed' else None
+        return await self._fetch_ids("set_tasks_status", task_ids, status, completed_at, user_id)
+
+    async def reassign_tasks(
+        self,
+        task_ids: List[int],
+        assignee_id: Optional[int],
+        user_id: Optional[int] = None
+    ) -> List[int]:
+        """
+        Назначить исполнителя нескольким задачам одним запросом
+
+        Returns:
+            ID задач, которые были обновлены
+        """
+        return await self._fetch_ids("reassign_tasks", task_ids, assignee_id, user_id)
+
+    async def _page(self, listing: str, args: tuple, limit: int, cursor: Optional[str]) -> Page:
+        """
+        Выбрать страницу списка по курсору (keyset pagination)
+
+        Запрашивается на одну строку больше limit, чтобы узнать, есть ли
+        страница дальше в направлении чтения.
+
+        Raises:
+            ValueError: если курсор поврежден
+        """
+        column = TASK_LISTINGS[listing][3]
+        direction = "next"
+
+        async with self.pool.acquire() as conn:
+            if cursor is None:
+                statement = await _statement(conn, f"{listing}_first")
+                rows = await statement.fetch(*args, limit + 1)
+            else:
+                direction, key, created_at, task_id = decode_cursor(cursor)
+                suffix = "after" if direction == "next" else "before"
+                statement = await _statement(conn, f"{listing}_{suffix}")
+                rows = await statement.fetch(*args, key, created_at, task_id, limit + 1)
+                if not rows and direction == "prev":
+                    # Задачи перед курсором удалены - возвращаем начало списка,
+                    # а не пустую страницу без курсоров
+                    direction, cursor = "next", None
+                    statement = await _statement(conn, f"{listing}_first")
+                    rows = await statement.fetch(*args, limit + 1)
+
+        items = [dict(row) for row in rows[:limit]]
+        has_more = len(rows) > limit
+
+        if direction == "prev":
+            # Предыдущая страница выбиралась в обратном порядке
+            items.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, cursor is not None
+
+        if not items:
+            return Page(items, None, None)
+
+        return Page(
+            items,
+            encode_cursor(items[-1], column, "next") if has_next else None,
+            encode_cursor(items[0], column, "prev") if has_prev else None,
+        )
+
+    async def archive_closed_tasks(self, after_days: int, batch_size: int) -> int:
+        """
+        Перенести задачи, закрытые больше after_days дней назад, в холодный архив
+
+        Returns:
+            Сколько задач перенесено
+        """
+        moved = 0
+        while True:
+            async with self.pool.acquire() as conn:
+                statement = await _statement(conn, "archive_closed_tasks")
+                await statement.fetch(after_days, batch_size)
+                batch = int(statement.get_statusmsg().split()[-1])
+            moved += batch
+            if batch < batch_size:
+                return moved
+
+    async def get_mood_stats(self, user_id: int) -> Dict[str, dict]:
+        """
+        Статистика самочувствия пользователя за MOOD_PERIODS
+
+        Читает только дневные агрегаты (не больше 2 строк на день), поэтому
+        не зависит от длины истории.
+        """
+        today = datetime.now(timezone.utc).date()
+        longest = max(MOOD_PERIODS.values())
+        async with self.pool.acquire() as conn:
+            statement = await _statement(conn, "mood_daily")
+            rows = await statement.fetch(user_id, today - timedelta(days=longest - 1))
+
+        return {
+            name: summarize_mood(rows, today - timedelta(days=days - 1), days)
+            for name, days in MOOD_PERIODS.items()
+        }
+
+    async def _fetch_ids(self, name: str, *args) -> List[int]:
+        async with self.pool.acquire() as conn:
+            statement = await _statement(conn, name)
+            rows = await statement.fetch(*args)
+        return [row['id'] for row in rows]
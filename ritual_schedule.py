@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Расчет времени следующего ритуала
+
+Время ритуалов хранится как местное время суток (TIME) в часовом поясе
+пользователя (users.timezone; если не задан - RITUAL_DEFAULT_TIMEZONE, по
+умолчанию часовой пояс сервера, как до появления часовых поясов). Ближайший момент отправки заранее
+переводится в UTC и сохраняется в users.next_ritual_at; планировщик держит
+ближайшие моменты в очереди с приоритетом и спит до первого из них.
+"""
+
+import heapq
+import os
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def get_zone(name: Optional[str]) -> Optional[ZoneInfo]:
+    """Часовой пояс по имени IANA (Europe/Moscow); None, если имя неизвестно"""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def server_timezone() -> str:
+    """Имя часового пояса сервера (TZ или /etc/localtime), иначе UTC"""
+    name = os.getenv("TZ", "").lstrip(":")
+    if get_zone(name):
+        return name
+    
+    localtime = os.path.realpath("/etc/localtime")
+    if "zoneinfo/" in localtime:
+        name = localtime.split("zoneinfo/", 1)[1]
+        if get_zone(name):
+            return name
+    return "UTC"
+
+
+# Часовой пояс пользователей, которые не выбрали свой (/пояс)
+DEFAULT_TIMEZONE = (
+    os.getenv("RITUAL_DEFAULT_TIMEZONE") if get_zone(os.getenv("RITUAL_DEFAULT_TIMEZONE"))
+    else server_timezone()
+)
+
+
+def user_zone(user: dict) -> ZoneInfo:
+    """Часовой пояс пользователя (DEFAULT_TIMEZONE, если не задан или некорректен)"""
+    return get_zone(user.get('timezone')) or ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def local_now(user: dict) -> datetime:
+    """Текущее время в часовом поясе пользователя"""
+    return datetime.now(user_zone(user))
+
+
+def is_ritual_user(user: dict) -> bool:
+    """Получает ли пользователь ритуалы (онбординг пройден и задано время)"""
+    return user.get('onboarding_step') == 'completed' and (
+        user.get('morning_ritual_time') is not None or user.get('evening_ritual_time') is not None
+    )
+
+
+def next_fire_time(ritual_time: time, after: datetime, zone: ZoneInfo) -> datetime:
+    """
+    Ближайший момент (UTC) строго после after, когда в zone наступает ritual_time
+
+    Переходы на летнее время: несуществующее местное время (перевод часов
+    вперед) сдвигается вперед на величину перевода, неоднозначное (перевод
+    назад) берется по первому наступлению.
+    """
+    ritual_time = ritual_time.replace(second=0, microsecond=0, tzinfo=None)
+    local_date = after.astimezone(zone).date()
+    for days in range(3):
+        fire = datetime.combine(local_date + timedelta(days=days), ritual_time, tzinfo=zone)
+        fire = fire.astimezone(timezone.utc)
+        if fire > after:
+            return fire
+    raise ValueError(f"Не удалось рассчитать время {ritual_time} после {after}")
+
+
+def next_ritual(user: dict, after: datetime) -> Optional[Tuple[datetime, str]]:
+    """
+    Ближайший ритуал пользователя после after
+
+    Returns:
+        (момент отправки в UTC, 'morning' или 'evening') или None, если
+        ритуалы пользователю не отправляются
+    """
+    if not is_ritual_user(user):
+        return None
+
+    zone = user_zone(user)
+    candidates = [
+        (next_fire_time(user[f'{ritual_type}_ritual_time'], after, zone), ritual_type)
+        for ritual_type in ("morning", "evening")
+        if user.get(f'{ritual_type}_ritual_time') is not None
+    ]
+    return min(candidates)
+
+
+class RitualQueue:
+    """
+    Очередь ближайших ритуалов (min-heap по времени отправки)
+
+    У пользователя не больше одной актуальной записи: при переносе старая
+    запись остается в куче и пропускается при извлечении.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, int]] = []
+        self._fire_times: Dict[int, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._fire_times)
+
+    def schedule(self, user_id: int, fire_at: Optional[datetime]):
+        """Запланировать ритуал пользователя (None - снять с очереди)"""
+        if fire_at is None:
+            self._fire_times.pop(user_id, None)
+            return
+        if self._fire_times.get(user_id) == fire_at:
+            return
+        self._fire_times[user_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, user_id))
+
+    def clear(self):
+        self._heap.clear()
+        self._fire_times.clear()
+
+    def next_fire_time(self) -> Optional[datetime]:
+        """Время ближайшего ритуала в очереди"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> List[int]:
+        """Извлечь пользователей, чей ритуал наступил к моменту now"""
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, user_id = heapq.heappop(self._heap)
+            del self._fire_times[user_id]
+            due.append(user_id)
+
+    def _drop_stale(self):
+        while self._heap and self._fire_times.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
@@ -0,0 +1,84 @@
+import asyncio
+
+from batch_writer import BatchWriter
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_failed_batch_is_retried_first_in_order():
+    batches = []
+    failures = [RuntimeError("db down")]
+
+    async def flush(batch):
+        if failures:
+            raise failures.pop()
+        batches.append(list(batch))
+
+    async def main():
+        writer = BatchWriter(flush, max_batch=2, max_delay=0.02)
+        writer.start()
+        writer.add(1)
+        writer.add(2)
+        # Пачка [1, 2] не записалась; новая запись не должна ее обогнать
+        await asyncio.sleep(0.01)
+        writer.add(3)
+        await asyncio.sleep(0.1)
+        await writer.close()
+
+    run(main())
+
+    assert not failures
+    assert batches == [[1, 2], [3]]
+
+
+def test_overflow_drops_oldest_records():
+    written = []
+
+    async def flush(batch):
+        written.extend(batch)
+
+    async def main():
+        writer = BatchWriter(flush, max_batch=2, max_delay=10, max_pending=3)
+        for record in range(1, 6):
+            writer.add(record)
+        pending = writer.pending_count
+        await writer.close()
+        return pending
+
+    assert run(main()) == 3
+    assert written == [3, 4, 5]
+
+
+def test_close_writes_remainder():
+    batches = []
+
+    async def flush(batch):
+        batches.append(list(batch))
+
+    async def main():
+        writer = BatchWriter(flush, max_batch=2, max_delay=10)
+        writer.start()
+        for record in range(5):
+            writer.add(record)
+        await asyncio.wait_for(writer.close(), 1)
+        return writer.pending_count
+
+    assert run(main()) == 0
+    assert [record for batch in batches for record in batch] == list(range(5))
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+def test_close_keeps_records_when_flush_fails():
+    async def flush(batch):
+        raise RuntimeError("db down")
+
+    async def main():
+        writer = BatchWriter(flush, max_batch=10, max_delay=10)
+        writer.add(1)
+        writer.add(2)
+        await writer.close()
+        return writer.pending_count
+
+    assert run(main()) == 2
@@ -0,0 +1,87 @@
+import asyncio
+
+from dispatcher import KeyedDispatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_items_of_one_key_are_processed_in_order():
+    processed = []
+
+    async def handler(item):
+        key, n = item
+        # Ранние элементы обрабатываются дольше: без порядка по ключу они бы обогнались
+        await asyncio.sleep(0.01 * (5 - n))
+        processed.append(item)
+        return n
+
+    async def main():
+        dispatcher = KeyedDispatcher(handler, max_workers=10)
+        items = [(key, (key, n)) for n in range(5) for key in ("a", "b")]
+        return await dispatcher.dispatch(items)
+
+    results = run(main())
+
+    assert results == [n for n in range(5) for _ in ("a", "b")]
+    for key in ("a", "b"):
+        assert [n for k, n in processed if k == key] == list(range(5))
+
+
+def test_different_keys_run_concurrently_up_to_max_workers():
+    running = 0
+    peak = 0
+
+    async def handler(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def main():
+        dispatcher = KeyedDispatcher(handler, max_workers=3)
+        await dispatcher.dispatch((key, key) for key in range(10))
+
+    run(main())
+
+    assert peak == 3
+
+
+def test_failed_item_does_not_stop_its_key():
+    processed = []
+
+    async def handler(item):
+        if item == 1:
+            raise RuntimeError("boom")
+        processed.append(item)
+        return item
+
+    async def main():
+        dispatcher = KeyedDispatcher(handler, max_workers=2)
+        return await dispatcher.dispatch([("a", 0), ("a", 1), ("a", 2)])
+
+    results = run(main())
+
+    assert results[0] == 0 and results[2] == 2
+    assert isinstance(results[1], RuntimeError)
+    assert processed == [0, 2]
+
+
+def test_close_cancels_pending_items():
+    async def handler(item):
+        await asyncio.sleep(10)
+
+    async def main():
+        dispatcher = KeyedDispatcher(handler, max_workers=1)
+        first = dispatcher.submit("a", 0)
+        second = dispatcher.submit("a", 1)
+        await asyncio.sleep(0)
+        await dispatcher.close()
+        return first, second, dispatcher.pending_count
+
+    first, second, pending = run(main())
+
+    assert first.cancelled() and second.cancelled()
+    assert pending == 0
@@ -0,0 +1,171 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from outbound_queue import OutboundQueue, TokenBucket, is_retryable, parse_retry_after
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_queue(**kwargs) -> OutboundQueue:
+    options = dict(
+        workers=4,
+        global_rate=1000,
+        global_burst=1000,
+        recipient_rate=1000,
+        recipient_burst=1000,
+        backoff_base=0.001,
+        backoff_max=0.01,
+    )
+    options.update(kwargs)
+    return OutboundQueue(**options)
+
+
+def scripted_attempt(responses, calls):
+    """Попытка отправки, отвечающая по очереди заданными ответами"""
+    responses = iter(responses)
+
+    async def attempt():
+        calls.append(time.monotonic())
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return attempt
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None),
+    ("", None),
+    ("3", 3.0),
+    ("0.5", 0.5),
+    ("-1", 0.0),
+    ("soon", None),
+])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+
+    assert 25 < parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+
+
+@pytest.mark.parametrize("response, expected", [
+    (httpx.Response(429), True),
+    (httpx.Response(503), True),
+    (httpx.Response(400, text='{"code": "attachment.not.ready"}'), True),
+    (httpx.Response(400, text='{"code": "bad.request"}'), False),
+    (httpx.Response(403), False),
+])
+def test_is_retryable(response, expected):
+    assert is_retryable(response) is expected
+
+
+def test_token_bucket_limits_rate():
+    async def main():
+        bucket = TokenBucket(rate=100, capacity=2)
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Два токена из запаса, еще два - по 10 мс
+    assert run(main()) >= 0.015
+
+
+def test_429_is_retried_after_retry_after():
+    calls = []
+    attempt = scripted_attempt(
+        [httpx.Response(429, headers={"Retry-After": "0.05"}), httpx.Response(200)],
+        calls
+    )
+
+    async def main():
+        queue = make_queue()
+        return await (await queue.put(1, attempt))
+
+    assert run(main()) is True
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.05
+
+
+def test_429_pauses_global_bucket():
+    calls = []
+    attempt = scripted_attempt(
+        [httpx.Response(429, headers={"Retry-After": "0.05"}), httpx.Response(200)],
+        calls
+    )
+
+    async def main():
+        queue = make_queue()
+        done = await queue.put(1, attempt)
+        while not calls:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        # Другие запросы к API ждут, пока не истечет Retry-After
+        await queue.throttle()
+        throttled_at = time.monotonic()
+        await done
+        return throttled_at
+
+    assert run(main()) - calls[0] >= 0.045
+
+
+def test_client_error_is_not_retried():
+    calls = []
+    attempt = scripted_attempt([httpx.Response(400, text='{"code": "bad.request"}')], calls)
+
+    async def main():
+        queue = make_queue()
+        return await (await queue.put(1, attempt))
+
+    assert run(main()) is False
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_attempts():
+    calls = []
+    responses = [httpx.Response(503), httpx.ConnectError("down"), httpx.Response(502), httpx.Response(200)]
+    attempt = scripted_attempt(responses, calls)
+
+    async def main():
+        queue = make_queue(max_attempts=3)
+        return await (await queue.put(1, attempt))
+
+    assert run(main()) is False
+    assert len(calls) == 3
+
+
+def test_messages_to_one_recipient_keep_order():
+    sent = []
+
+    def attempt_for(recipient, n):
+        async def attempt():
+            # Первые сообщения отправляются дольше и первые ответы - 429
+            await asyncio.sleep(0.005 * (3 - n))
+            if n == 0 and (recipient, n) not in retried:
+                retried.add((recipient, n))
+                return httpx.Response(429, headers={"Retry-After": "0.01"})
+            sent.append((recipient, n))
+            return httpx.Response(200)
+        return attempt
+
+    retried = set()
+
+    async def main():
+        queue = make_queue(workers=2)
+        done = [await queue.put(recipient, attempt_for(recipient, n)) for n in range(3) for recipient in "ab"]
+        return await asyncio.gather(*done)
+
+    assert all(run(main()))
+    for recipient in "ab":
+        assert [n for r, n in sent if r == recipient] == [0, 1, 2]
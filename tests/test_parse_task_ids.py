@@ -0,0 +1,30 @@
+import pytest
+
+from longpolling_bot import BULK_TASK_LIMIT, parse_task_ids
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5", [5]),
+    (" 3 5 8 ", [3, 5, 8]),
+    ("3, 5,8", [3, 5, 8]),
+    ("3,\t5\n8", [3, 5, 8]),
+    ("3-7", [3, 4, 5, 6, 7]),
+    ("7-7", [7]),
+    ("1 3-5, 9", [1, 3, 4, 5, 9]),
+    # Повторы убираются, порядок - по первому упоминанию
+    ("5 3-6 5", [5, 3, 4, 6]),
+    (f"1-{BULK_TASK_LIMIT}", list(range(1, BULK_TASK_LIMIT + 1))),
+    ("", []),
+    ("   ", []),
+    ("7-3", []),
+    (f"1-{BULK_TASK_LIMIT + 1}", []),
+    ("5 abc", []),
+    ("#5", []),
+    ("-5", []),
+    ("3-", []),
+    ("3--5", []),
+    ("3.5", []),
+    ("1-2-3", []),
+])
+def test_parse_task_ids(text, expected):
+    assert parse_task_ids(text) == expected
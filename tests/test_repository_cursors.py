@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from repository import (
+    STATEMENTS,
+    Repository,
+    _keyset_statements,
+    decode_cursor,
+    decode_search_cursor,
+    encode_cursor,
+    encode_search_cursor,
+)
+
+NOW = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def raw_cursor(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def test_cursor_round_trip():
+    task = {'id': 7, 'deadline': NOW + timedelta(days=1), 'created_at': NOW}
+
+    assert decode_cursor(encode_cursor(task, "deadline", "next")) == ("next", task['deadline'], NOW, 7)
+    assert decode_cursor(encode_cursor(task, "deadline", "prev"))[0] == "prev"
+
+
+def test_cursor_without_key():
+    task = {'id': 7, 'deadline': None, 'created_at': NOW}
+
+    assert decode_cursor(encode_cursor(task, "deadline", "next")) == ("next", None, NOW, 7)
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not a cursor",
+    encode_search_cursor({'rank': 0.5, 'id': 1}, "fulltext"),
+    raw_cursor(["up", None, NOW.isoformat(), 1]),
+    raw_cursor(["next", None, NOW.isoformat(), "1"]),
+    raw_cursor(["next", "tomorrow", NOW.isoformat(), 1]),
+])
+def test_corrupted_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_search_cursor_round_trip():
+    cursor = encode_search_cursor({'rank': 0.25, 'id': 3}, "fuzzy")
+
+    assert decode_search_cursor(cursor) == ("fuzzy", 0.25, 3)
+    with pytest.raises(ValueError):
+        decode_search_cursor(encode_search_cursor({'rank': 0.25, 'id': 3}, "regex"))
+    with pytest.raises(ValueError):
+        decode_search_cursor(encode_cursor({'id': 1, 'deadline': None, 'created_at': NOW}, "deadline", "next"))
+
+
+def test_keyset_seek_conditions():
+    ascending = _keyset_statements("l", ("tasks",), "t.chat_id = $1", 1, "deadline", "infinity", False)
+    descending = _keyset_statements("l", ("tasks",), "t.chat_id = $1", 1, "completed_at", "-infinity", True)
+
+    key = "COALESCE(t.deadline, 'infinity')"
+    cursor_key = "COALESCE($2::timestamptz, 'infinity')"
+    assert f"{key} > {cursor_key}" in ascending["l_after"]
+    assert "(t.created_at, t.id) < ($3, $4)" in ascending["l_after"]
+    assert f"{key} < {cursor_key}" in ascending["l_before"]
+    assert "(t.created_at, t.id) > ($3, $4)" in ascending["l_before"]
+    assert ascending["l_after"].endswith("LIMIT $5)")
+    assert ascending["l_first"].endswith("LIMIT $2)")
+
+    assert "COALESCE(t.completed_at, '-infinity') < COALESCE($2::timestamptz, '-infinity')" in descending["l_after"]
+    assert "ORDER BY COALESCE(t.completed_at, '-infinity') ASC, t.created_at ASC, t.id ASC" in descending["l_before"]
+
+
+def test_keyset_statements_union_tables():
+    statements = _keyset_statements(
+        "l", ("tasks", "tasks_archive"), "t.chat_id = $1", 1, "completed_at", "-infinity", True
+    )
+
+    for sql in statements.values():
+        assert "FROM tasks t" in sql and "FROM tasks_archive t" in sql
+        assert " UNION ALL " in sql
+
+
+class FakeStatement:
+    """Выполняет запрос списка active_tasks по задачам в памяти"""
+
+    def __init__(self, name: str, tasks: list):
+        self.name = name
+        self.tasks = tasks
+
+    @staticmethod
+    def sort_key(deadline, created_at, task_id):
+        # deadline ASC (NULL - в конце), created_at DESC, id DESC
+        return (deadline or datetime.max.replace(tzinfo=timezone.utc), -created_at.timestamp(), -task_id)
+
+    async def fetch(self, chat_id, *args):
+        rows = sorted(self.tasks, key=lambda t: self.sort_key(t['deadline'], t['created_at'], t['id']))
+        if self.name.endswith("_first"):
+            (limit,) = args
+            return rows[:limit]
+
+        key, created_at, task_id, limit = args
+        cursor = self.sort_key(key, created_at, task_id)
+        if self.name.endswith("_after"):
+            return [t for t in rows if self.sort_key(t['deadline'], t['created_at'], t['id']) > cursor][:limit]
+        rows = [t for t in reversed(rows) if self.sort_key(t['deadline'], t['created_at'], t['id']) < cursor]
+        return rows[:limit]
+
+
+class FakeConnection:
+    def __init__(self, tasks: list):
+        self.tasks = tasks
+        self.statements = {}
+
+    async def prepare(self, sql: str):
+        name = next(name for name, statement in STATEMENTS.items() if statement == sql)
+        return FakeStatement(name, self.tasks)
+
+
+class FakePool:
+    def __init__(self, tasks: list):
+        self.conn = FakeConnection(tasks)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def test_pages_forward_and_back():
+    # Равные дедлайны и даты создания, часть задач без дедлайна
+    tasks = [
+        {
+            'id': n,
+            'deadline': NOW + timedelta(days=n % 3) if n % 4 else None,
+            'created_at': NOW - timedelta(minutes=n % 2),
+        }
+        for n in range(1, 11)
+    ]
+    repo = Repository(FakePool(tasks))
+
+    async def walk():
+        pages = [await repo.get_active_tasks(1, 3)]
+        while pages[-1].next_cursor:
+            pages.append(await repo.get_active_tasks(1, 3, pages[-1].next_cursor))
+        back = [pages[-1]]
+        while back[-1].prev_cursor:
+            back.append(await repo.get_active_tasks(1, 3, back[-1].prev_cursor))
+        return pages, back
+
+    pages, back = asyncio.run(walk())
+
+    ordered = sorted(tasks, key=lambda t: FakeStatement.sort_key(t['deadline'], t['created_at'], t['id']))
+    assert [t['id'] for page in pages for t in page.items] == [t['id'] for t in ordered]
+    assert pages[0].prev_cursor is None
+    assert [[t['id'] for t in page.items] for page in reversed(back)] == [[t['id'] for t in page.items] for page in pages]
+
+
+def test_prev_page_after_deletion_falls_back_to_first_page():
+    tasks = [{'id': n, 'deadline': NOW + timedelta(days=n), 'created_at': NOW} for n in range(1, 8)]
+    repo = Repository(FakePool(tasks))
+
+    async def walk():
+        first = await repo.get_active_tasks(1, 3)
+        second = await repo.get_active_tasks(1, 3, first.next_cursor)
+        # Все задачи перед второй страницей удалены
+        del tasks[:3]
+        return await repo.get_active_tasks(1, 3, second.prev_cursor)
+
+    page = asyncio.run(walk())
+
+    assert [t['id'] for t in page.items] == [4, 5, 6]
+    assert page.prev_cursor is None
+    assert page.next_cursor is not None
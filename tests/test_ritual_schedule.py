@@ -0,0 +1,111 @@
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import ritual_schedule
+from ritual_schedule import RitualQueue, next_fire_time, next_ritual, user_zone
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_next_fire_time_today_and_tomorrow():
+    moscow = ZoneInfo("Europe/Moscow")
+
+    assert next_fire_time(time(9, 0), utc(2026, 5, 1, 5, 0), moscow) == utc(2026, 5, 1, 6, 0)
+    # Время уже прошло (и ровно наступило) - следующий день
+    assert next_fire_time(time(9, 0), utc(2026, 5, 1, 6, 0), moscow) == utc(2026, 5, 2, 6, 0)
+
+
+def test_next_fire_time_ignores_seconds():
+    assert next_fire_time(time(9, 0, 45), utc(2026, 5, 1, 0, 0), ZoneInfo("UTC")) == utc(2026, 5, 1, 9, 0)
+
+
+def test_next_fire_time_spring_forward_gap():
+    # 29.03.2026 в Берлине 02:00 -> 03:00: 02:30 не существует, сдвигается на час вперед
+    fire = next_fire_time(time(2, 30), utc(2026, 3, 28, 12, 0), BERLIN)
+
+    assert fire == utc(2026, 3, 29, 1, 30)
+    assert fire.astimezone(BERLIN).strftime("%H:%M") == "03:30"
+
+
+def test_next_fire_time_fall_back_first_occurrence():
+    # 25.10.2026 в Берлине 03:00 -> 02:00: 02:30 наступает дважды, берется первое
+    after = utc(2026, 10, 24, 12, 0)
+
+    assert next_fire_time(time(2, 30), after, BERLIN) == utc(2026, 10, 25, 0, 30)
+    # После первого наступления - на следующий день, а не повторно через час
+    assert next_fire_time(time(2, 30), utc(2026, 10, 25, 0, 30), BERLIN) == utc(2026, 10, 26, 1, 30)
+
+
+def test_user_zone_falls_back_to_default(monkeypatch):
+    monkeypatch.setattr(ritual_schedule, "DEFAULT_TIMEZONE", "Europe/Moscow")
+
+    assert user_zone({'timezone': "Asia/Tokyo"}).key == "Asia/Tokyo"
+    assert user_zone({'timezone': None}).key == "Europe/Moscow"
+    assert user_zone({'timezone': "Mars/Olympus"}).key == "Europe/Moscow"
+
+
+def test_server_timezone_from_tz(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Moscow")
+    assert ritual_schedule.server_timezone() == "Europe/Moscow"
+
+    monkeypatch.setenv("TZ", ":Asia/Tokyo")
+    assert ritual_schedule.server_timezone() == "Asia/Tokyo"
+
+
+def test_next_ritual_picks_nearest():
+    user = {
+        'onboarding_step': 'completed',
+        'timezone': "UTC",
+        'morning_ritual_time': time(8, 0),
+        'evening_ritual_time': time(21, 0),
+    }
+
+    assert next_ritual(user, utc(2026, 5, 1, 12, 0)) == (utc(2026, 5, 1, 21, 0), "evening")
+    assert next_ritual(user, utc(2026, 5, 1, 22, 0)) == (utc(2026, 5, 2, 8, 0), "morning")
+    assert next_ritual({**user, 'onboarding_step': 'evening'}, utc(2026, 5, 1, 12, 0)) is None
+    assert next_ritual({**user, 'morning_ritual_time': None, 'evening_ritual_time': None}, utc(2026, 5, 1)) is None
+
+
+def test_ritual_queue_pops_due_in_order():
+    queue = RitualQueue()
+    start = utc(2026, 5, 1, 8, 0)
+    queue.schedule(1, start + timedelta(minutes=2))
+    queue.schedule(2, start)
+    queue.schedule(3, start + timedelta(minutes=10))
+
+    assert len(queue) == 3
+    assert queue.next_fire_time() == start
+    assert queue.pop_due(start + timedelta(minutes=5)) == [2, 1]
+    assert queue.next_fire_time() == start + timedelta(minutes=10)
+    assert len(queue) == 1
+
+
+def test_ritual_queue_reschedule_and_remove():
+    queue = RitualQueue()
+    start = utc(2026, 5, 1, 8, 0)
+    queue.schedule(1, start)
+    queue.schedule(2, start + timedelta(minutes=1))
+
+    # Перенос оставляет старую запись в куче - она должна пропускаться
+    queue.schedule(1, start + timedelta(minutes=30))
+    queue.schedule(2, None)
+
+    assert len(queue) == 1
+    assert queue.next_fire_time() == start + timedelta(minutes=30)
+    assert queue.pop_due(start + timedelta(minutes=5)) == []
+    assert queue.pop_due(start + timedelta(minutes=30)) == [1]
+    assert queue.next_fire_time() is None
+
+
+def test_ritual_queue_duplicate_schedule_is_noop():
+    queue = RitualQueue()
+    start = utc(2026, 5, 1, 8, 0)
+    queue.schedule(1, start)
+    queue.schedule(1, start)
+
+    assert queue.pop_due(start) == [1]
+    assert queue.pop_due(start) == []